@@ -1,6 +1,11 @@
 WTF_CSRF_ENABLED = True
 SECRET_KEY = "you-will-never-guess-this-awesome-secret-key" #The WTF_CSRF_ENABLED setting activates the cross-site request forgery prevention
 UPLOAD_FOLDER = '/webannot/upload'
+RESULT_STORE = False #packs report files of each job into a single SQLite file (results.sqlite) instead of a directory of small files
+CRISPR_CATALOG = None #path of SQLite catalog fed with DR consensuses and spacers of every job, queried at /crispr_detect/catalog
+CRISPR_PIPELINE = False #reads sequences and writes results in threads while jobs are analysed
+CRISPR_CACHE_DIR = None #directory caching first and second pass results of sequences, so resubmissions of same sequences with other parameters resume from them
+CRISPR_CACHE_SIZE = 256 #maximum size of cache in MB, least recently used results are removed
 DEBUG = {{ microbannot.debug }}
 THREADED = True
 CRISPR_OUTPUT_MOUNT={{ microbannot.crispr_output_mount }} #is the dir used for --volume /tmp/crispr:/webannot/upload:rw \
@@ -3,6 +3,11 @@ WTF_CSRF_ENABLED = True
 # prevention
 SECRET_KEY = "you-will-never-guess-my-cristal-secret-key"
 UPLOAD_FOLDER = '/tmp/crispr'
+RESULT_STORE = False #packs report files of each job into a single SQLite file (results.sqlite) instead of a directory of small files
+CRISPR_CATALOG = None #path of SQLite catalog fed with DR consensuses and spacers of every job, queried at /crispr_detect/catalog
+CRISPR_PIPELINE = False #reads sequences and writes results in threads while jobs are analysed
+CRISPR_CACHE_DIR = None #directory caching first and second pass results of sequences, so resubmissions of same sequences with other parameters resume from them
+CRISPR_CACHE_SIZE = 256 #maximum size of cache in MB, least recently used results are removed
 DEBUG = True
 THREADED = True
 CRISPR_OUPUT_MOUNT= "/tmp/crispr" #is the dir used for --volume /tmp/crispr:/webannot/upload:rw \
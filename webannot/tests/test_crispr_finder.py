@@ -0,0 +1,561 @@
+import unittest
+import tempfile
+import random
+import types
+import gzip
+import io
+import os
+import sys
+import json
+import pickle
+from unittest import mock
+import numpy
+from contextlib import redirect_stdout
+from webannot.CRISPRFinder_beta2_11 import read_fasta, FastaReader, FastaList, FastaIndex, FindCRISPRs, EncodedSeq, FastaSeq, Pattern, Repeat, CRISPR, ResultStore, Catalog, parameter_grid
+
+
+def random_sequence(rand, length):
+    return ''.join(rand.choice('ACGT') for i in range(length))
+
+
+# random genome with a CRISPR array (dr_count copies of a repeat separated by random spacers)
+def crispr_genome(seed, length=20000, dr_count=8):
+    rand = random.Random(seed)
+    dr = random_sequence(rand, 32)
+    array = dr
+    for i in range(dr_count - 1):
+        array += random_sequence(rand, rand.randint(30, 42)) + dr
+    flank = (length - len(array)) // 2
+    return random_sequence(rand, flank) + array + random_sequence(rand, length - flank - len(array))
+
+
+class CrisprFinderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.system("rm -rf %s" % self.tempdir)
+
+    def run_finder(self, path, **options):
+        output_dir = os.path.join(self.tempdir, 'output')
+        with redirect_stdout(io.StringIO()):
+            finder = FindCRISPRs(path, output_dir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False, **options)
+            finder.analyze()
+        return finder
+
+    def crispr_coordinates(self, finder):
+        return [[[(dr.begin, dr.end) for dr in crispr.DR] for crispr in crisprs] for crisprs in finder.CRISPRs_all]
+
+    def write_fasta(self, content, filename="input.fasta", compress=False):
+        path = os.path.join(self.tempdir, filename)
+        if compress:
+            with gzip.open(path, 'wt') as fasta_file:
+                fasta_file.write(content)
+        else:
+            with open(path, 'w') as fasta_file:
+                fasta_file.write(content)
+        return path
+
+    def test_read_fasta_is_streaming(self):
+        path = self.write_fasta(">first\nACGT\nTTGA\n>second\nGGCC\n")
+        records = read_fasta(path)
+        assert isinstance(records, types.GeneratorType)
+        first = next(records)
+        assert first.header == ">first"
+        assert first.sequence == "ACGTTTGA"
+
+    def test_read_fasta_records(self):
+        path = self.write_fasta(">first\nACGT\nTTGA\n>empty\n>second\nGGCC\nAA")
+        records = [(r.header, r.sequence) for r in FastaReader(path)]
+        assert records == [(">first", "ACGTTTGA"), (">second", "GGCCAA")]
+        # reader can be iterated several times
+        assert len(list(FastaReader(path))) == 2
+        assert [r.sequence for r in FastaList(path).fna_list] == ["ACGTTTGA", "GGCCAA"]
+
+    def test_read_fasta_gzip(self):
+        path = self.write_fasta(">first\r\nACGT\r\nTTGA\r\n", "input.fasta.gz", compress=True)
+        records = [(r.header, r.sequence) for r in FastaReader(path)]
+        assert records == [(">first", "ACGTTTGA")]
+
+    def test_fasta_index(self):
+        sequences = [random_sequence(random.Random(i), 1000 + 7 * i) for i in range(3)]
+        path = self.write_fasta(''.join('>seq%d description\n' % i + '\n'.join(
+            sequence[j:j + 60] for j in range(0, len(sequence), 60)) + '\n' for i, sequence in enumerate(sequences)))
+        index = FastaIndex(path)
+        assert index.names == ['seq0', 'seq1', 'seq2']
+        assert index.entries['seq1'] == [1007, 1053, 60, 61]
+        assert index.header('seq2') == '>seq2 description'
+        for i, sequence in enumerate(sequences):
+            assert index.fetch('seq%d' % i) == sequence
+            assert index.fetch('seq%d' % i, 59, 181) == sequence[59:181]
+        index.close()
+        # index saved in samtools format is reused
+        with open(path + '.fai') as fai_file:
+            assert fai_file.readline() == 'seq0\t1000\t18\t60\t61\n'
+        assert FastaIndex(path).entries == index.entries
+
+    def test_regions(self):
+        genome = crispr_genome(1)
+        path = self.write_fasta('>other\n' + random_sequence(random.Random(2), 5000) + '\n>genome\n' + genome + '\n')
+        whole = self.crispr_coordinates(self.run_finder(path))
+        assert whole[1]
+        region = self.run_finder(path, regions=['genome:8001-12000'])
+        assert region.headers_all == ['>genome genome:8001-12000']
+        assert self.crispr_coordinates(region) == whole[1:]
+        assert self.crispr_coordinates(self.run_finder(path, regions=[('other', 0, 5000)])) == whole[:1]
+        # region up to end of record
+        region = self.run_finder(path, regions=[('genome', 8000, None)])
+        assert region.headers_all == ['>genome genome:8001-%d' % len(genome)]
+        assert self.crispr_coordinates(region) == whole[1:]
+
+    def test_encoded_sequence(self):
+        encoded = EncodedSeq("ACgtNRac")
+        assert list(encoded.codes) == [0, 1, 2, 3, 4, 4, 0, 1]
+        assert list(encoded.mask) == [False] * 4 + [True] * 2 + [False] * 2
+        assert len(encoded) == 8
+        assert encoded[1:6] == "CGTNN"
+        assert encoded[-1] == "C"
+        path = self.write_fasta(">seq\nACgtNRac\n")
+        assert next(read_fasta(path, encode=True)).sequence.codes.tolist() == encoded.codes.tolist()
+
+    def test_count_mismatches_on_codes(self):
+        finder = FindCRISPRs.__new__(FindCRISPRs)
+        rand = random.Random(3)
+        for i in range(200):
+            column = [rand.choice('ACGTN') for j in range(rand.randint(1, 12))]
+            assert finder.count_mismatches(EncodedSeq(''.join(column)).codes) == finder.count_mismatches(column)
+
+    def test_encoded_analysis(self):
+        genome = crispr_genome(4)
+        upper = self.crispr_coordinates(self.run_finder(self.write_fasta('>genome\n' + genome + '\n')))
+        assert upper[0]
+        path = self.write_fasta('>genome\n' + genome.lower() + '\n', "lower.fasta")
+        assert self.crispr_coordinates(self.run_finder(path, encode=True)) == upper
+
+    def test_output_formats(self):
+        path = self.write_fasta('>first desc\n' + crispr_genome(21) + '\n>second\n' + crispr_genome(22) + '\n')
+        finder = self.run_finder(path, output_formats=['jsonl', 'tsv', 'gff3'])
+        output_dir = os.path.join(self.tempdir, 'output')
+        # legacy report files are not written
+        assert sorted(os.listdir(output_dir)) == ['CRISPRs.gff3', 'CRISPRs.jsonl', 'CRISPRs.tsv']
+        with open(os.path.join(output_dir, 'CRISPRs.jsonl')) as jsonl_file:
+            records = [json.loads(line) for line in jsonl_file]
+        assert [[(dr['begin'], dr['end']) for dr in record['DRs']] for record in records] == sum(self.crispr_coordinates(finder), [])
+        assert [(record['sequence'], record['crispr']) for record in records] == [('first', 1), ('second', 1)]
+        with open(os.path.join(output_dir, 'CRISPRs.tsv')) as tsv_file:
+            lines = [line.rstrip('\n').split('\t') for line in tsv_file]
+        assert len(lines) == 3 and lines[1][:4] == ['first', '1', str(records[0]['begin']), str(records[0]['end'])]
+        with open(os.path.join(output_dir, 'CRISPRs.gff3')) as gff_file:
+            features = [line.split('\t') for line in gff_file if not line.startswith('#')]
+        assert len(features) == sum(1 + len(record['DRs']) + len(record['spacers']) for record in records)
+        assert features[0][:5] == ['first', 'CRISPRFinder', 'CRISPR', str(records[0]['begin']), str(records[0]['end'])]
+
+    def test_result_store(self):
+        path = self.write_fasta('>first\n' + crispr_genome(23) + '\n')
+        output_dir = os.path.join(self.tempdir, 'output')
+        self.run_finder(path)
+        files = {}
+        for root, dirs, names in os.walk(output_dir):
+            for name in names:
+                with open(os.path.join(root, name)) as report_file:
+                    files[os.path.relpath(os.path.join(root, name), output_dir)] = report_file.read()
+        os.system("rm -rf %s" % output_dir)
+        self.run_finder(path, result_store=True)
+        # report files are only in store, with same paths and contents (except run date)
+        assert os.listdir(output_dir) == ['results.sqlite']
+        store = ResultStore(os.path.join(output_dir, 'results.sqlite'))
+        assert store.list() == sorted(files)
+        for name in files:
+            assert store.read(name).split('\n')[4:] == files[name].split('\n')[4:]
+        assert store.read('missing') is None
+        store.close()
+
+    def test_catalog(self):
+        catalog_path = os.path.join(self.tempdir, 'catalog.sqlite')
+        first = self.run_finder(self.write_fasta('>first\n' + crispr_genome(24) + '\n'), catalog=catalog_path)
+        crispr = first.CRISPRs_all[0][0]
+        # same genome in another file is catalogued too
+        self.run_finder(self.write_fasta('>second\n' + crispr_genome(24) + '\n', "second.fasta"), catalog=catalog_path)
+        catalog = Catalog(catalog_path)
+        hits = catalog.query(crispr.DR_consensus.lower())
+        assert [(hit['kind'], hit['record'], hit['begin'], hit['end'], hit['mismatches']) for hit in hits] ==\
+            [('DR', 'first', crispr.begin, crispr.end, 0), ('DR', 'second', crispr.begin, crispr.end, 0)]
+        spacer = crispr.spacers[1].sequence
+        mutated = spacer[:3] + ('A' if spacer[3] != 'A' else 'C') + spacer[4:-1] + ('A' if spacer[-1] != 'A' else 'C')
+        assert catalog.query(mutated) == []
+        assert catalog.query(mutated, 1) == []
+        hits = catalog.query(mutated, 2)
+        assert [(hit['kind'], hit['sequence'], hit['mismatches']) for hit in hits] == [('spacer', spacer, 2)] * 2
+        catalog.close()
+
+    def test_pipeline(self):
+        content = ''.join('>seq%d\n%s\n' % (i, crispr_genome(30 + i)) for i in range(5))
+        path = self.write_fasta(content)
+        expected = self.crispr_coordinates(self.run_finder(path))
+        for workers in (1, 2):
+            finder = self.run_finder(path, pipeline=True, workers=workers)
+            assert self.crispr_coordinates(finder) == expected
+            assert finder.headers_all == ['>seq%d' % i for i in range(5)]
+        # errors of reader thread are raised by analyze
+        with self.assertRaises(IOError):
+            self.run_finder(os.path.join(self.tempdir, 'missing.fasta'), pipeline=True)
+        # errors of writer thread stop analysis
+        analyze_record = FindCRISPRs.analyze_record
+        with mock.patch.object(FindCRISPRs, 'finish_record', side_effect=IOError('disk full')), \
+         mock.patch.object(FindCRISPRs, 'analyze_record', autospec=True, side_effect=analyze_record) as analyzed:
+            with self.assertRaises(IOError):
+                self.run_finder(path, pipeline=True)
+        assert analyzed.call_count < 5
+
+    def test_stage_cache(self):
+        path = self.write_fasta(''.join('>seq%d\n%s\n' % (i, crispr_genome(50 + i)) for i in range(3)))
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        expected = self.crispr_coordinates(self.run_finder(path))
+        assert self.crispr_coordinates(self.run_finder(path, cache_dir=cache_dir)) == expected
+        entries = sorted(os.listdir(cache_dir))
+        assert len([entry for entry in entries if entry.startswith('zones_')]) == 3
+        assert len([entry for entry in entries if entry.startswith('clusters_')]) == 3
+        # results are read from cache (cached clusters are used as they are)
+        for entry in entries:
+            if entry.startswith('clusters_'):
+                with open(os.path.join(cache_dir, entry), 'w') as entry_file:
+                    json.dump([], entry_file)
+        assert self.crispr_coordinates(self.run_finder(path, cache_dir=cache_dir)) == [[], [], []]
+        # zones are reused with other second pass parameters, clusters are computed again
+        with redirect_stdout(io.StringIO()):
+            finder = FindCRISPRs(path, os.path.join(self.tempdir, 'output'), 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.4, 200, False, cache_dir=cache_dir)
+            finder.analyze()
+        entries = os.listdir(cache_dir)
+        assert len([entry for entry in entries if entry.startswith('zones_')]) == 3
+        assert len([entry for entry in entries if entry.startswith('clusters_')]) == 6
+        # least recently used entries are removed
+        small_cache_dir = os.path.join(self.tempdir, 'small_cache')
+        assert self.crispr_coordinates(self.run_finder(path, cache_dir=small_cache_dir, cache_size=0.001)) == expected
+        assert sum(os.path.getsize(os.path.join(small_cache_dir, entry)) for entry in os.listdir(small_cache_dir)) <= 0.001 * 1024 * 1024
+        assert len(os.listdir(small_cache_dir)) < 6
+
+    def test_metagenome(self):
+        rand = random.Random(7)
+        contigs = []
+        for i in range(40):
+            if i % 4 == 0:
+                contigs.append(crispr_genome(60 + i, length=rand.choice([400, 1500, 3000]), dr_count=rand.randint(2, 5)))
+            else:
+                contigs.append(random_sequence(rand, rand.choice([30, 80, 200, 600])))
+        path = self.write_fasta(''.join('>contig%d\n%s\n' % (i, contig) for i, contig in enumerate(contigs)))
+        expected = self.run_finder(path)
+        expected = [(header, coordinates) for header, coordinates in zip(expected.headers_all, self.crispr_coordinates(expected)) if coordinates]
+        assert len(expected) == 9
+        for encode in (False, True):
+            # several batches (contigs are counted alone) and a single one
+            for batch_size in (1, 1000000):
+                with mock.patch('webannot.CRISPRFinder_beta2_11.METAGENOME_BATCH_SIZE', batch_size):
+                    finder = self.run_finder(path, metagenome=True, encode=encode)
+                assert list(zip(finder.headers_all, self.crispr_coordinates(finder))) == expected
+        # contigs shorter than two DRs and a spacer are skipped
+        assert finder.min_array_length() == 2 * 23 + 0.6 * 23
+        # options not used by metagenome mode are refused
+        for options in ({'workers': 2}, {'pipeline': True}, {'cache_dir': self.tempdir}, {'prefilter': True, 'verify_prefilter': True}):
+            with self.assertRaises(SystemExit), redirect_stdout(io.StringIO()):
+                FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False, metagenome=True, **options)
+
+    def test_sweep(self):
+        path = self.write_fasta(''.join('>seq%d\n%s\n' % (i, crispr_genome(40 + i)) for i in range(3)))
+        parameter_sets = parameter_grid({'min_dr': [23, 30], 'window_size': [150, 200], 'max_spacer_dr_ratio': [1.2, 2.5]})
+        assert len(parameter_sets) == 8
+        with redirect_stdout(io.StringIO()):
+            finder = FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+            table = finder.sweep(parameter_sets)
+        # same CRISPRs as separate analyses
+        for set_number, parameters in enumerate(parameter_sets, 1):
+            arguments = [3, '####_####', parameters['window_size'], 1, 20, parameters['min_dr'], 55, 0.6, parameters['max_spacer_dr_ratio'], 200, False]
+            with redirect_stdout(io.StringIO()):
+                single = FindCRISPRs(path, os.path.join(self.tempdir, 'single'), *arguments)
+                single.analyze()
+            expected = [(i, crispr.begin, crispr.end, crispr.DR_consensus) for i, crisprs in enumerate(single.CRISPRs_all) for crispr in crisprs]
+            assert [(int(row['sequence'][3:]), row['begin'], row['end'], row['DR_consensus']) for row in table if row['set'] == set_number] == expected
+            assert all(row['min_dr'] == parameters['min_dr'] for row in table if row['set'] == set_number)
+
+    def test_ring_first_pass(self):
+        genome = crispr_genome(5)
+        path = self.write_fasta('>genome\n' + genome + '\n>short\nACGTACGTTT\n')
+        window = self.run_finder(path)
+        ring = self.run_finder(path, first_pass_engine='ring')
+        assert self.crispr_coordinates(ring) == self.crispr_coordinates(window)
+        assert window.CRISPRs_all[0]
+        finder = FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        fasta = next(iter(finder.fastas))
+        finder.get_sequence_counts(fasta)
+        assert list(finder.stream_sequence_counts(fasta)) == finder.k_mer_counts
+
+    def test_align_seeds(self):
+        genome = crispr_genome(10, length=8000, dr_count=12)
+        finder = FindCRISPRs(self.write_fasta('>genome\n' + genome + '\n'), self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        fasta = next(iter(finder.fastas))
+        finder.first_pass(fasta)
+        aligned = 0
+        for zone in finder.repeat_list_first_pass:
+            finder.clusters = []
+            finder.get_pattern_counts(zone)
+            finder.extract_clusters(zone)
+            for cluster in finder.clusters:
+                seed, ref_number, ref_seed_pos = cluster.most_repeated
+                # first complete seed of each repeat, found by scanning repeat
+                expected = [ref_seed_pos]
+                for repeat in cluster.repeats[ref_number + 1:]:
+                    seeds = finder.pattern.extract_patterns(repeat.sequence, complete_only=True)
+                    limit = max(len(repeat.sequence) - finder.pattern.n_symbols, 0)
+                    expected.append(seeds.index(seed, 0, limit) if seed in seeds[:limit] else -1)
+                positions = finder.align_seeds(cluster)
+                assert positions == [position for position in expected if position != -1]
+                assert finder.local_positions[seed] == [i for i, patt in enumerate(finder.local_lookup_table) if patt == seed]
+                aligned += len(positions)
+        assert aligned >= 12
+
+    def test_seed_first_pass(self):
+        genome = crispr_genome(9, length=30000)
+        path = self.write_fasta('>genome\n' + genome + '\n>short\nACGTACGTTT\n')
+        window = self.run_finder(path)
+        seed = self.run_finder(path, first_pass_engine='seed')
+        assert window.CRISPRs_all[0]
+        assert self.crispr_coordinates(seed) == self.crispr_coordinates(window)
+        # cached zones aren't shared with window engine nor with other longest spacer
+        cache_dir = os.path.join(self.tempdir, 'cache')
+        self.run_finder(path, cache_dir=cache_dir)
+        self.run_finder(path, first_pass_engine='seed', cache_dir=cache_dir)
+        with redirect_stdout(io.StringIO()):
+            FindCRISPRs(path, os.path.join(self.tempdir, 'output'), 3, '####_####', 200, 1, 20, 23, 55, 0.6, 1.2, 200, False, first_pass_engine='seed', cache_dir=cache_dir).analyze()
+        assert len([entry for entry in os.listdir(cache_dir) if entry.startswith('zones_')]) == 6
+        # sweep uses seed engine, chunked records and metagenome mode don't
+        parameter_sets = parameter_grid({'min_dr': [23, 30], 'max_spacer_dr_ratio': [1.2, 2.5]})
+        with redirect_stdout(io.StringIO()):
+            finder = FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False, first_pass_engine='seed')
+            table = finder.sweep(parameter_sets)
+            for set_number, parameters in enumerate(parameter_sets, 1):
+                arguments = [3, '####_####', 200, 1, 20, parameters['min_dr'], 55, 0.6, parameters['max_spacer_dr_ratio'], 200, False]
+                single = FindCRISPRs(path, os.path.join(self.tempdir, 'single'), *arguments, first_pass_engine='seed')
+                single.analyze()
+                expected = [(i, crispr.begin, crispr.end) for i, crisprs in enumerate(single.CRISPRs_all) for crispr in crisprs]
+                assert [(int(row['sequence'] != 'genome'), row['begin'], row['end']) for row in table if row['set'] == set_number] == expected
+            for options in ({'workers': 2, 'chunk_size': 10000}, {'metagenome': True}):
+                with self.assertRaises(SystemExit):
+                    FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False, first_pass_engine='seed', **options)
+        # ranks of seeds are ordered as seeds, long seeds are ranked by prefix doubling
+        finder = FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        rand = random.Random(9)
+        sequence = random_sequence(rand, 100) + 'ACGTAC' * 20 + random_sequence(rand, 100)
+        codes = finder.sequence_codes(sequence)
+        for depth in (1, 11, 40, 100):
+            ranks = finder.seed_ranks(codes, depth)
+            prefixes = [sequence[i:i + depth] for i in range(len(sequence) - depth + 1)]
+            assert len(ranks) == len(prefixes)
+            assert [prefixes[i] for i in numpy.argsort(ranks, kind='mergesort')] == sorted(prefixes)
+            assert len(set(ranks.tolist())) == len(set(prefixes))
+
+    def test_prefilter(self):
+        genome = crispr_genome(8, length=30000)
+        path = self.write_fasta('>genome\n' + genome + '\n>short\nACGTACGTTT\n')
+        expected = self.crispr_coordinates(self.run_finder(path))
+        assert expected[0]
+        for engine in ('window', 'ring', 'vector'):
+            finder = self.run_finder(path, first_pass_engine=engine, prefilter=True, verify_prefilter=True)
+            assert self.crispr_coordinates(finder) == expected
+        # only parts of sequence around possible repeats are counted, zones are the same
+        finder = FindCRISPRs(path, self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        fasta = next(iter(finder.fastas))
+        ranges = finder.sketch_ranges(fasta.sequence)
+        assert sum(end - start for start, end in ranges) < len(genome) / 2
+        finder.first_pass(fasta)
+        zones = [(zone.begin, zone.end) for zone in finder.repeat_list_first_pass]
+        assert all(any(start < begin and end <= stop for start, stop in ranges) for begin, end in zones)
+        finder.prefilter = True
+        finder.first_pass(fasta)
+        assert [(zone.begin, zone.end) for zone in finder.repeat_list_first_pass] == zones
+
+    def test_vector_first_pass(self):
+        genome = crispr_genome(6)
+        path = self.write_fasta('>genome\n' + genome + '\n>short\nACGTACGTTT\n')
+        window = self.run_finder(path)
+        vector = self.run_finder(path, first_pass_engine='vector')
+        assert self.crispr_coordinates(vector) == self.crispr_coordinates(window)
+        finder = FindCRISPRs(path, self.tempdir, 3, '##########_##########', 50, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        rand = random.Random(7)
+        for sequence in [genome, 'ACGT' * 40, 'AC', random_sequence(rand, 300).lower() + 'NNRY' * 10]:
+            fasta = FastaSeq('>sequence', sequence)
+            finder.window_size = 50
+            finder.get_sequence_counts(fasta)
+            counts = finder.k_mer_counts
+            finder.window_size = 50
+            finder.vector_sequence_counts(fasta)
+            assert finder.k_mer_counts.tolist() == counts
+
+    def test_array_repeats(self):
+        finder = FindCRISPRs(self.write_fasta(">seq\nACGT\n"), self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 30, False)
+        rand = random.Random(8)
+        for i in range(300):
+            counts = [rand.choice([1, 1, 2]) if rand.random() < 0.9 else 1 for j in range(rand.randint(0, 300))]
+            fasta = FastaSeq('>sequence', random_sequence(rand, len(counts)))
+            zones = []
+            for engine_counts in [counts, numpy.array(counts)]:
+                finder.repeat_list_first_pass = []
+                finder.get_repeats(fasta, engine_counts)
+                zones.append([(repeat.sequence, repeat.begin, repeat.end) for repeat in finder.repeat_list_first_pass])
+            assert zones[0] == zones[1]
+
+    def test_pattern_seeds(self):
+        pattern = Pattern('##_#__#')
+        assert len(pattern) == 4
+        assert pattern.extract_pattern('ACGTACGTA', 0) == 'ACTG'
+        assert pattern.extract_pattern('ACGTACGTA', 4) == 'ACT'
+        assert pattern.extract_patterns('ACGTACGTA') == ['ACTG', 'CGAT', 'GTCA', 'TAG', 'ACT', 'CGA', 'GT', 'TA', 'A']
+        assert pattern.extract_patterns('ACGTACGTA', complete_only=True) == ['ACTG', 'CGAT', 'GTCA']
+
+    def test_workers(self):
+        genomes = [crispr_genome(seed, length=6000) for seed in range(9, 14)]
+        # short record first: its shortened window must not be used for next records
+        content = '>short\n' + random_sequence(random.Random(9), 120) + '\n'
+        content += ''.join('>genome%d\n%s\n' % (i, genome) for i, genome in enumerate(genomes))
+        path = self.write_fasta(content)
+        alone = self.crispr_coordinates(self.run_finder(self.write_fasta('>genome0\n' + genomes[0] + '\n', "alone.fasta")))
+        sequential = self.run_finder(path)
+        assert self.crispr_coordinates(sequential)[1] == alone[0]
+        parallel = self.run_finder(path, workers=3)
+        assert parallel.headers_all == sequential.headers_all
+        assert self.crispr_coordinates(parallel) == self.crispr_coordinates(sequential)
+        assert [[str(crispr) for crispr in crisprs] for crisprs in parallel.CRISPRs_all] ==\
+         [[str(crispr) for crispr in crisprs] for crisprs in sequential.CRISPRs_all]
+
+    def test_chunked_record(self):
+        genome = crispr_genome(14, length=30000, dr_count=10)
+        path = self.write_fasta('>genome\n' + genome + '\n>small\n' + crispr_genome(15, length=3000) + '\n')
+        sequential = self.run_finder(path)
+        assert sequential.CRISPRs_all[0]
+        chunked = self.run_finder(path, workers=2, chunk_size=4000)
+        assert self.crispr_coordinates(chunked) == self.crispr_coordinates(sequential)
+        # records shorter than window analysed before by the same workers don't change windows of chunks
+        short = ''.join('>short%d\n%s\n' % (i, random_sequence(random.Random(i), 60)) for i in range(8))
+        path = self.write_fasta(short + '>genome\n' + genome + '\n', "short_first.fasta")
+        sequential = self.run_finder(path)
+        assert sequential.CRISPRs_all[-1]
+        chunked = self.run_finder(path, workers=2, chunk_size=4000)
+        assert self.crispr_coordinates(chunked) == self.crispr_coordinates(sequential)
+        fasta = FastaSeq('>genome', genome)
+        chunks = [chunked.range_counts(genome, start, min(start + 777, len(genome))) for start in range(0, len(genome), 777)]
+        chunked.vector_sequence_counts(fasta)
+        assert numpy.concatenate(chunks).tolist() == chunked.k_mer_counts.tolist()
+
+    def test_search_DRs_long_array(self):
+        rand = random.Random(16)
+        dr = random_sequence(rand, 30)
+        sequence = random_sequence(rand, 100)
+        coordinates = []
+        for i in range(300):
+            coordinates.append((len(sequence) + 1, len(sequence) + len(dr)))
+            sequence += dr + random_sequence(rand, rand.randint(30, 40))
+        sequence += random_sequence(rand, 100)
+        fasta = FastaSeq('>array', sequence)
+        finder = FindCRISPRs(self.write_fasta(">seq\nACGT\n"), self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        middle = [Repeat(sequence[begin - 1:end], begin, end) for begin, end in coordinates[20:22]]
+        crispr = CRISPR(middle, fasta)
+        finder.CRISPRs = [crispr]
+        # DRs are searched one after another without recursion
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(200)
+        try:
+            finder.look_after_CRISPR(fasta, crispr)
+            finder.look_before_CRISPR(fasta, crispr)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        assert len(crispr.DR) == len(coordinates)
+        assert [dr.begin for dr in crispr.DR] == [begin for begin, end in coordinates]
+
+    def test_check_truncated(self):
+        rand = random.Random(18)
+        dr = random_sequence(rand, 32)
+        spacers = [random_sequence(rand, 36) for i in range(4)]
+        # first and last DRs of array are truncated
+        sequence = random_sequence(rand, 60) + dr[10:] + spacers[0] + dr + spacers[1] + dr + spacers[2] + dr + spacers[3] + dr[:20] + random_sequence(rand, 60)
+        begins = [60 + 22 + 36 + 1, 60 + 22 + 36 + 32 + 36 + 1, 60 + 22 + 3 * 36 + 2 * 32 + 1]
+        fasta = FastaSeq('>array', sequence)
+        finder = FindCRISPRs(self.write_fasta(">seq\nACGT\n"), self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        crispr = CRISPR([Repeat(dr, begin, begin + 31) for begin in begins], fasta)
+        finder.check_truncated(crispr, fasta, -1)
+        finder.check_truncated(crispr, fasta, 1)
+        assert [(repeat.begin, repeat.end) for repeat in crispr.DR] == [(51, 82)] + [(begin, begin + 31) for begin in begins] + [(323, 354)]
+        assert crispr.DR[0].sequence[10:] == dr[10:]
+        assert crispr.DR[-1].sequence[:20] == dr[:20]
+
+    def test_detect_tracrRNA(self):
+        rand = random.Random(19)
+        dr = random_sequence(rand, 32)
+        copy = dr[:5] + ('A' if dr[5] != 'A' else 'C') + dr[6:]
+        array = dr + random_sequence(rand, 36) + dr + random_sequence(rand, 36) + dr
+        sequence = random_sequence(rand, 300) + array + random_sequence(rand, 200) + copy + random_sequence(rand, 100) + copy + random_sequence(rand, 50)
+        fasta = FastaSeq('>array', sequence)
+        finder = FindCRISPRs(self.write_fasta(">seq\nACGT\n"), self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, True)
+        finder.CRISPRs = [CRISPR([Repeat(dr, begin, begin + 31) for begin in (301, 369, 437)], fasta)]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            finder.detect_tracrRNA(fasta)
+        # DRs of array are masked, both copies are detected
+        first = 300 + len(array) + 200
+        second = first + 32 + 100
+        assert output.getvalue().splitlines() == ['tracrRNA detected at %s - %s for %s.' % (first + 1, first + 32, dr),
+                                                  'tracrRNA detected at %s - %s for %s.' % (second + 1, second + 32, dr)]
+
+    def test_consensus_profile(self):
+        rand = random.Random(20)
+        sequence = random_sequence(rand, 2000)
+        fasta = FastaSeq('>array', sequence)
+        crispr = CRISPR([Repeat(random_sequence(rand, 25), 1000, 1024)], fasta)
+        for i in range(20):
+            if i % 2:
+                crispr.insert_DR(Repeat(random_sequence(rand, 25).lower(), crispr.begin - 60, crispr.begin - 36), fasta, 0)
+            else:
+                crispr.insert_DR(Repeat(random_sequence(rand, 25), crispr.end + 36, crispr.end + 60), fasta)
+            # consensus is updated on insert as if computed from scratch
+            consensus = crispr.DR_consensus
+            crispr.calculate_consensus()
+            assert crispr.DR_consensus == consensus
+            assert crispr.profile.sum() == 25 * len(crispr.DR)
+        crispr.trim_profile(2, 3)
+        assert crispr.DR_consensus == consensus[2:-3]
+
+    def test_repeat_views(self):
+        sequence = EncodedSeq('ACGTACGGTTCAGT')
+        repeat = Repeat(sequence, 3, 7, 2)
+        assert repeat.sequence == 'GTACG' and len(repeat) == 5
+        # coordinates are moved without changing sequence
+        repeat.begin += 100
+        repeat.end += 100
+        assert repeat.sequence == 'GTACG'
+        # repeat outside of sequence is sliced as before
+        assert Repeat(sequence, 12, 16, 11).sequence == 'AGT'
+        repeat.sequence = repeat.sequence[1:]
+        repeat.begin += 1
+        assert repeat.sequence == 'TACG' and len(repeat) == 4
+        # only sequence of repeat is pickled
+        copy = pickle.loads(pickle.dumps(repeat))
+        assert copy.source == 'TACG' and (copy.begin, copy.end) == (104, 107)
+        assert not hasattr(repeat, '__dict__')
+        # results don't keep sequence of record
+        genome = crispr_genome(3)
+        for encode in (False, True):
+            finder = self.run_finder(self.write_fasta('>genome\n' + genome + '\n'), encode=encode)
+            crispr = finder.CRISPRs_all[0][0]
+            assert all(element.source == genome[element.begin - 1 : element.end] for element in crispr.DR + crispr.spacers)
+
+    def test_filter_k_mer_matches(self):
+        finder = FindCRISPRs(self.write_fasta(">seq\nACGT\n"), self.tempdir, 3, '####_####', 200, 1, 20, 23, 55, 0.6, 2.5, 200, False)
+        rand = random.Random(17)
+        for i in range(100):
+            reference = random_sequence(rand, rand.randint(0, 30))
+            spacer = ''.join(rand.choice('AC') for j in range(rand.randint(0, 40)))
+            # number of pairs of equal k-mers, last k-mer of both sequences excluded
+            matches = sum(1 for j in range(len(reference) - 3) for k in range(len(spacer) - 3) if reference[j:j + 3] == spacer[k:k + 3])
+            assert finder.count_k_mer_matches(finder.filter_k_mers(reference), finder.filter_k_mers(spacer)) == matches
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -131,6 +131,13 @@ class CrisprFormTestCase(unittest.TestCase):
             params = self.parse_cmd_parameters(str(stdout_file.read()))
             return params
 
+    def send_crispr_form_options(self, data):
+        self.send_crispr_form(data)
+        uuid = os.listdir(webannot.app.config['UPLOAD_FOLDER'])[0]
+        with open(os.path.join(webannot.app.config['UPLOAD_FOLDER'], uuid, 'stdout'), 'r') as stdout_file:
+            match = re.search(r"Options: (\{.*\})", stdout_file.read())
+            return eval(match.group(1))
+
     def test_k_mer_size_filter_crispr_form(self):
         self.data_form['k_mer_size_filter'] = 4
         params = self.send_crispr_form(self.data_form)
@@ -197,5 +204,16 @@ class CrisprFormTestCase(unittest.TestCase):
         assert params[2:] == [
             3, '####_####', 200, 1, 20, 23, 25, 0.6, 2.5, 200, True]
 
+    def test_output_format_crispr_form(self):
+        self.data_form['output_format'] = ['legacy', 'gff3']
+        options = self.send_crispr_form_options(self.data_form)
+        assert options == {'output_formats': ['legacy', 'gff3'], 'result_store': False, 'catalog': None, 'pipeline': False,
+                           'cache_dir': None, 'cache_size': 256}
+
+    def test_default_output_format_crispr_form(self):
+        options = self.send_crispr_form_options(self.data_form)
+        assert options == {'output_formats': ['legacy'], 'result_store': False, 'catalog': None, 'pipeline': False,
+                           'cache_dir': None, 'cache_size': 256}
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,24 @@ import re
 import os
 import sys
 import time
+import gzip
+import mmap
 import datetime
+import io
+import json
+import hashlib
+import bisect
+import math
+import sqlite3
+import copy
+import itertools
+import numpy
+import contextlib
+import collections
+import concurrent.futures
+import queue
+import threading
+import urllib.parse
 
 ################
 # File Classes #
@@ -12,40 +29,329 @@ import datetime
 # fasta file, which contains header and sequence
 
 class FastaSeq:
-	def __init__ (self, header, sequence):
+	def __init__ (self, header, sequence, offset = 0):
 		self.header = header		# header of fasta file
 		self.sequence = sequence 	# sequence itself
+		self.offset = offset		# position of sequence within its record (when only a region is read)
+
+	# replaces sequence string by its compact EncodedSeq version
+	def encode (self):
+		if not isinstance(self.sequence, EncodedSeq):
+			self.sequence = EncodedSeq(self.sequence)
 		
 
-# contains list of all sequences in fasta file
+# codes used by EncodedSeq : A, C, G and T (whatever the case) are coded 0 to 3, 
+# N and any other (ambiguity) character by N_CODE
+N_CODE = 4
+ENCODING_TABLE = numpy.full(256, N_CODE, dtype=numpy.uint8)
+for code, nucl in enumerate('ACGT'):
+	ENCODING_TABLE[ord(nucl)] = code
+	ENCODING_TABLE[ord(nucl.lower())] = code
+DECODING_TABLE = numpy.frombuffer(b'ACGTN', dtype=numpy.uint8)
+
+
+# compact representation of DNA sequence, one byte (code) per base in numpy array. Case is 
+# normalized once when encoding, so EncodedSeq is equivalent to upper case sequence where 
+# ambiguity characters are replaced by N. Indexing and slicing return strings, so EncodedSeq can 
+# be used wherever sequence string is expected, while codes can be used for array operations
+#	-	codes is uint8 array of codes (see N_CODE)
+#	-	mask is boolean array, True for N (ambiguous) positions
+
+class EncodedSeq:
+	def __init__ (self, sequence):
+		if isinstance(sequence, str):
+			sequence = sequence.encode('ascii', 'replace')
+		self.codes = ENCODING_TABLE[numpy.frombuffer(sequence, dtype=numpy.uint8)]
+
+	@property
+	def mask (self):
+		return self.codes == N_CODE
+
+	def __getitem__ (self, key):
+		if isinstance(key, slice):
+			return DECODING_TABLE[self.codes[key]].tobytes().decode()
+		return 'ACGTN'[self.codes[key]]
+
+	def __len__ (self):
+		return len(self.codes)
+
+	def __str__ (self):
+		return self[:]
+
+
+
+# checks magic number of gzip (and bgzip, which is a series of gzip blocks) compressed files
+def is_gzip(file_path):
+	with open(file_path, 'rb') as file_content:
+		return file_content.read(2) == b'\x1f\x8b'
+
+
+# opens fasta file in text mode, compressed files are decompressed on the fly
+def open_fasta(file_path):
+	if is_gzip(file_path):
+		return gzip.open(file_path, 'rt')
+	return open(file_path, 'r')
+
+
+# generator yielding sequences of fasta file one by one (FastaSeq objects), so that only 
+# the record being read is kept in memory. Lines of sequence are collected in a list and 
+# joined once the record is complete. If encode is True, sequences are given as EncodedSeq
+def read_fasta(file_path, encode = False):
+	with open_fasta(file_path) as file_content:
+		header = ""			# header of record
+		sequence_parts = []		# lines of DNA sequence
 
-class FastaList:
-	def __init__ (self, file_path):
-		self.fna_list =	[]		# list of fasta_seq objects
-		
-		file_content = open(file_path, 'r')
-		header=""			# header of file
-		sequence=""			# DNA sequence
-		
 		for file_line in file_content:
-			if re.match('>', file_line):		# new sequence in multifasta
+			if file_line.startswith('>'):		# new sequence in multifasta
+				sequence = ''.join(sequence_parts)
 				if (header != "" and sequence != ""):	# if not first ">" in file
-					self.fna_list.append(FastaSeq(header, sequence))	
-					
-				header = file_line[0:-1]	# last character is newline
-				sequence = ""			# reset sequence if new file
+					yield FastaSeq(header, EncodedSeq(sequence) if encode else sequence)
+
+				header = file_line.rstrip('\r\n')
+				sequence_parts = []			# reset sequence if new record
 			else:
-				sequence = sequence + file_line[0:-1]	# append sequence part
+				sequence_parts.append(file_line.rstrip('\r\n'))	# append sequence part
+
+		# yield last record
+		sequence = ''.join(sequence_parts)
+		if (header != "" and sequence != ""):	# just in case
+			yield FastaSeq(header, EncodedSeq(sequence) if encode else sequence)
+
+
+# streams sequences of fasta file, each iteration reopens the file and yields FastaSeq objects
+
+class FastaReader:
+	def __init__ (self, file_path, encode = False):
+		self.file_path = file_path
+		self.encode = encode
+
+	def __iter__ (self):
+		return read_fasta(self.file_path, self.encode)
+
+
+# samtools-style index (.fai) of uncompressed fasta file, giving random access to any region
+# of any record. The fasta file is memory-mapped, so only bytes of requested regions are read.
+# Index is loaded from file_path + '.fai' if it is up to date, built (and saved if possible) otherwise
+#	-	names contains names of records (first word of header) in order of file
+#	-	entries associates name - [length, offset, line_bases, line_width], offset being
+#		 position of first base in file, line_bases number of bases per line and line_width
+#		 number of bytes per line (including newline characters)
+
+class FastaIndex:
+	def __init__ (self, file_path):
+		self.file_path = file_path
+		self.fai_path = file_path + '.fai'
+		self.names = []
+		self.entries = {}
+
+		if is_gzip(file_path):
+			print("Error: indexed access needs uncompressed fasta file (%s)." % file_path)
+			sys.exit()
+
+		self.file = open(file_path, 'rb')
+		if os.path.getsize(file_path) > 0:
+			self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self.data = b''
+
+		if os.path.exists(self.fai_path) and os.path.getmtime(self.fai_path) >= os.path.getmtime(file_path):
+			self.load()
+		else:
+			self.build()
+			self.save()
+
+	# reads existing .fai file
+	def load (self):
+		with open(self.fai_path, 'r') as fai_file:
+			for fai_line in fai_file:
+				fields = fai_line.rstrip('\r\n').split('\t')
+				if len(fields) < 5:
+					continue
+				self.names.append(fields[0])
+				self.entries[fields[0]] = [int(field) for field in fields[1:5]]
+
+	# scans mapped file for headers and computes layout of each record
+	def build (self):
+		header_start = self.data.find(b'>')
+		while header_start != -1:
+			header_end = self.data.find(b'\n', header_start)
+			if header_end == -1:
+				header_end = len(self.data)
+			next_header = self.data.find(b'\n>', header_end)
+			record_end = len(self.data) if next_header == -1 else next_header + 1
+
+			name = self.data[header_start+1 : header_end].decode().split()
+			name = name[0] if name else ""
+			offset = min(header_end + 1, record_end)
+			self.names.append(name)
+			self.entries[name] = self.layout(name, offset, record_end)
+
+			header_start = -1 if next_header == -1 else next_header + 1
+
+	# computes [length, offset, line_bases, line_width] of a record which sequence lays between 
+	# offset and record_end; all lines but the last one must have the same length
+	def layout (self, name, offset, record_end):
+		# blank lines at end of record are not part of sequence
+		while record_end > offset and self.data[record_end-1 : record_end] in (b'\n', b'\r'):
+			record_end -= 1
+		if record_end == offset:
+			return [0, offset, 0, 0]
+
+		first_newline = self.data.find(b'\n', offset, record_end)
+		if first_newline == -1:
+			return [record_end - offset, offset, record_end - offset, record_end - offset + 1]
+
+		line_width = first_newline - offset + 1
+		line_bases = line_width - 1
+		if self.data[first_newline-1 : first_newline] == b'\r':
+			line_bases -= 1
+
+		full_lines = (record_end - offset) // line_width
+		last_line = (record_end - offset) % line_width
+		length = full_lines * line_bases + min(last_line, line_bases)
+
+		# every line break has to be at expected place
+		content = numpy.frombuffer(self.data, dtype=numpy.uint8)
+		line_ends = offset + numpy.arange(1, full_lines + 1) * line_width - 1
+		if last_line > line_bases or not numpy.all(content[line_ends] == ord('\n')) \
+		 or self.data.find(b'\n', offset + full_lines * line_width, record_end) != -1:
+			print("Error: lines of sequence %s have different lengths, fasta file can't be indexed." % name)
+			sys.exit()
+
+		return [length, offset, line_bases, line_width]
+
+	# writes .fai file next to fasta file, if directory is not writable index is just kept in memory
+	def save (self):
+		try:
+			with open(self.fai_path, 'w') as fai_file:
+				for name in self.names:
+					fai_file.write(name + '\t' + '\t'.join(str(value) for value in self.entries[name]) + '\n')
+		except OSError:
+			pass
+
+	# returns full header of record (read just before its first base)
+	def header (self, name):
+		offset = self.entries[name][1]
+		header_start = self.data.rfind(b'>', 0, offset)
+		return self.data[header_start:offset].decode().rstrip('\r\n')
+
+	# returns sequence of record between start (included) and end (excluded), 0-based coordinates
+	def fetch (self, name, start = 0, end = None):
+		length, offset, line_bases, line_width = self.entries[name]
+		if end is None or end > length:
+			end = length
+		if start < 0:
+			start = 0
+		if start >= end:
+			return ""
+
+		first_byte = offset + (start // line_bases) * line_width + start % line_bases
+		last_byte = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+		region = self.data[first_byte : last_byte + 1]
+		return region.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+	def __len__ (self):
+		return len(self.names)
+
+	def close (self):
+		if isinstance(self.data, mmap.mmap):
+			self.data.close()
+		self.file.close()
+
+
+# parses region given as 'name' (whole record) or 'name:start-end' (1-based, end included, 
+# samtools notation) into tuple (name, start, end) with 0-based start and excluded end
+def parse_region(region):
+	if not isinstance(region, str):
+		return tuple(region)
+	match = re.match(r'^(.+):([\d,]+)-([\d,]+)$', region)
+	if match is None:
+		return (region, 0, None)
+	return (match.group(1), int(match.group(2).replace(',', '')) - 1, int(match.group(3).replace(',', '')))
+
+
+# reads regions of BED file (0-based start, end excluded)
+def read_bed(file_path):
+	regions = []
+	with open(file_path, 'r') as bed_file:
+		for bed_line in bed_file:
+			fields = bed_line.split()
+			if not fields or fields[0].startswith('#') or fields[0] in ('track', 'browser'):
+				continue
+			regions.append((fields[0], int(fields[1]), int(fields[2])))
+	return regions
+
+
+# reads only given regions of indexed fasta file, yields one FastaSeq per region. Position of 
+# region within its record is kept in FastaSeq.offset
+#	-	regions is a list of region strings (see parse_region) or tuples (name, start, end)
+
+class FastaRegionReader:
+	def __init__ (self, file_path, regions, encode = False):
+		self.file_path = file_path
+		self.regions = [parse_region(region) for region in regions]
+		self.encode = encode
+
+	def __iter__ (self):
+		index = FastaIndex(self.file_path)
+		try:
+			for name, start, end in self.regions:
+				if name not in index.entries:
+					print("Warning, sequence %s not found in %s, region skipped." % (name, self.file_path))
+					continue
+				header = index.header(name)
+				record_length = index.entries[name][0]
+				if end is None or end > record_length:
+					end = record_length
+				if start > 0 or end < record_length:
+					header += " %s:%d-%d" % (name, start + 1, end)
+				sequence = index.fetch(name, start, end)
+				if sequence != "":
+					yield FastaSeq(header, EncodedSeq(sequence) if self.encode else sequence, start)
+		finally:
+			index.close()
+
+
+# contains list of all sequences in fasta file (whole file is loaded in memory, 
+# FastaReader should be preferred for big files)
 
-		# append last element to list
-		if (header!="" and sequence !=""):	# just in case
-			self.fna_list.append(FastaSeq(header, sequence))
+class FastaList:
+	def __init__ (self, file_path):
+		self.fna_list =	list(read_fasta(file_path))		# list of fasta_seq objects
 			
 
 ###########################
 # Main CRISPRFinder Class #
 ###########################
 
+# number of records read in advance, and of analysed records waiting to be written, in pipelined 
+# analysis (see FindCRISPRs.analyze_pipelined)
+PIPELINE_QUEUE_SIZE = 2
+
+# number of bases of short records whose k-mers are counted together in metagenome mode (see 
+# FindCRISPRs.analyze_metagenome), records are separated by sentinel symbol (code of EncodedSeq
+# or character which isn't part of sequences)
+METAGENOME_BATCH_SIZE = 1000000
+SENTINEL_CODE = N_CODE + 1
+SENTINEL = '\x00'
+
+# parameters which can differ between parameter sets of a sweep (see FindCRISPRs.sweep), by their 
+# command line name, with corresponding attribute of FindCRISPRs
+SWEEP_PARAMETERS = {'kmer_size_filter': 'k_mer_size_filter', 'pattern': 'pattern', 'window_size': 'requested_window_size',\
+ 'allowed_mismatch': 'allowed_mismatch', 'spacer_dr_match_limit': 'spacer_dr_match_limit', 'min_dr': 'min_DR', 'max_dr': 'max_DR',\
+ 'min_spacer_dr_ratio': 'min_spacer_DR_ratio', 'max_spacer_dr_ratio': 'max_spacer_DR_ratio', 'first_pass_limit': 'first_pass_limit'}
+
+# ways of computing k-mer counts during first pass (see FindCRISPRs.first_pass)
+FIRST_PASS_ENGINES = ['window', 'ring', 'vector', 'seed']
+
+# length of minimizers of k-mers (at most k-mer size) in sketch of first pass prefilter (see 
+# FindCRISPRs.sketch_candidates)
+SKETCH_MINIMIZER_SIZE = 8
+
+# formats of results: 'legacy' report files (per sequence directory) and machine readable files
+# written by RESULT_WRITERS (see Output Writers)
+OUTPUT_FORMATS = ['legacy', 'jsonl', 'tsv', 'gff3']
+
 # class containing all variables and functions necessary to find CRISPRs
 #	-	file_path contains a path to .fasta file
 #	-	output_file defines path where result directory will be saved
@@ -65,17 +371,60 @@ class FastaList:
 #		 position is saved in lookup table
 #	-	k_mer_counts are counts for each k-mer for sequence
 #	-	repeat_list_first_pass contains "interesting zones" with possible repeats 
-#		 (thus possible CRISPRs)
+#		 (thus possible CRISPRs), as views of sequence with 1-based coordinates
 #	-	identity_limit specifies limit necessary to extend a repeat during alignment
+#	-	regions restricts analysis to some records or parts of records of indexed fasta file, 
+#		 it is a list of 'name' or 'name:start-end' strings or of (name, start, end) tuples 
+#		 (see parse_region and read_bed). Positions in results are given within whole records
+#	-	encode indicates if sequences are stored as EncodedSeq (compact, case insensitive, 
+#		 comparisons done on arrays of codes)
+#	-	first_pass_engine selects the way k-mer counts of first pass are obtained: 'window' keeps 
+#		 every k-mer of sequence in lookup table, 'ring' keeps only k-mers of actual window and 
+#		 streams counts to get_repeats (memory doesn't grow with sequence length), 'vector' computes 
+#		 counts of all positions at once with numpy (fastest, uses most memory), these three give the
+#		 same counts. 'seed' doesn't use window : it sorts exact seeds of min_DR/2 bp and keeps those 
+#		 repeated at distance of DR and spacer (see seed_sequence_counts). It isn't a drop-in 
+#		 replacement, its zones can differ from those of window (arrays missed by window can be 
+#		 found, boundaries can move), and it isn't available for chunked records and metagenome mode
+#	-	prefilter indicates if k-mers are counted by first_pass_engine only in parts of sequence 
+#		 where sketch of k-mers finds possible repeats (see prefiltered_counts), zones are the same.
+#		 With verify_prefilter, zones are also searched on whole sequence and compared (test mode, 
+#		 analysis stops with error if they differ). Prefilter isn't used by 'seed' engine
+#	-	workers is a number of processes analysing records in parallel (results are the same and 
+#		 in the same order as with one process)
+#	-	chunk_size: with several workers, records longer than chunk_size are split in chunks of 
+#		 chunk_size bp analysed in parallel (None to analyse every record in one process)
+#	-	output_formats lists formats of results (see OUTPUT_FORMATS), machine readable ones are 
+#		 written into single files of output directory as records are finished
+#	-	result_store indicates if legacy report files are packed into a single SQLite file 
+#		 (RESULT_STORE_NAME in output directory, see ResultStore) instead of a directory per sequence
+#	-	catalog is path of SQLite catalog (see Catalog) where DR consensuses and spacers of found 
+#		 CRISPRs are added (shared by several analyses), None to not use one
+#	-	pipeline indicates if records are read and results written by their own threads while 
+#		 records are analysed (see analyze_pipelined), results are the same. Messages of tracrRNA 
+#		 search are printed by writer thread, among messages of next records
+#	-	cache_dir is directory where first pass zones and second pass clusters of records are 
+#		 kept (see StageCache), so that analyses of same sequences with other parameters resume 
+#		 from deepest stage already computed, None to not use cache. cache_size is maximum size 
+#		 of cache in MB
+#	-	metagenome indicates if file is analysed as assembly of many short contigs (see 
+#		 analyze_metagenome): too short records are skipped, k-mers of records are counted by 
+#		 batches and only records with CRISPRs are reported (workers, chunk_size, pipeline, cache, 
+#		 prefilter and 'seed' engine can't be used with it)
 
 
 class FindCRISPRs:
 	def __init__ (self, file_path, output_path, k_mer_size_filter, pattern,\
 	 window_size, allowed_mismatch, spacer_dr_match_limit, min_DR, max_DR,\
-	 min_spacer_DR_ratio, max_spacer_DR_ratio, first_pass_limit, search_tracrRNA):
+	 min_spacer_DR_ratio, max_spacer_DR_ratio, first_pass_limit, search_tracrRNA, regions = None,\
+	 encode = False, first_pass_engine = 'window', workers = 1, chunk_size = None, output_formats = ('legacy',),\
+	 result_store = False, catalog = None, pipeline = False, cache_dir = None, cache_size = 256, metagenome = False, prefilter = False, verify_prefilter = False):
 
-		# file path
-		self.fastas = FastaList(file_path)
+		# file path, sequences are read one by one during analysis
+		if regions is None:
+			self.fastas = FastaReader(file_path, encode)
+		else:
+			self.fastas = FastaRegionReader(file_path, regions, encode)
 	
 		# pattern
 		self.pattern = Pattern(pattern)
@@ -89,6 +438,7 @@ class FindCRISPRs:
 		if self.k_mer_size_filter > self.k_mer_size:
 			print("Warning!! Size of filtering k-mer bigger than number of accepted symbols '#' in pattern, setting value to %d"%(self.k_mer_size - 1))
 		self.window_size = window_size
+		self.requested_window_size = window_size	# window_size is shortened for short sequences
 		self.allowed_mismatch = allowed_mismatch
 		self.spacer_dr_match_limit = spacer_dr_match_limit
 		self.min_DR = min_DR 
@@ -102,6 +452,57 @@ class FindCRISPRs:
 		
 		self.search_tracrRNA = search_tracrRNA
 
+		self.first_pass_engine = first_pass_engine
+		if self.first_pass_engine not in FIRST_PASS_ENGINES:
+			print("Error: unknown first pass engine '%s', choose one of: %s." % (self.first_pass_engine, ', '.join(FIRST_PASS_ENGINES)))
+			sys.exit()
+
+		self.prefilter = prefilter
+		self.verify_prefilter = verify_prefilter
+
+		self.workers = workers
+		if self.workers < 1:
+			print("Error: number of workers must be at least 1.")
+			sys.exit()
+		self.chunk_size = chunk_size
+		if self.chunk_size is not None and self.chunk_size < 1:
+			print("Error: chunk size must be at least 1.")
+			sys.exit()
+
+		self.output_formats = list(output_formats)
+		for output_format in self.output_formats:
+			if output_format not in OUTPUT_FORMATS:
+				print("Error: unknown output format '%s', choose among: %s." % (output_format, ', '.join(OUTPUT_FORMATS)))
+				sys.exit()
+		if not self.output_formats:
+			print("Error: at least one output format must be chosen.")
+			sys.exit()
+		self.writers = []			# writers of machine readable formats, opened during analysis
+		self.result_store = result_store
+		self.store = None			# ResultStore of report files, opened during analysis
+		self.catalog_path = catalog
+		self.catalog = None			# Catalog fed with CRISPRs of analysed records, opened during analysis
+		self.pipeline = pipeline
+		self.cache = None			# StageCache of first and second pass results, None to not use one
+		if cache_dir is not None:
+			if cache_size <= 0:
+				print("Error: size of cache must be positive.")
+				sys.exit()
+			self.cache = StageCache(cache_dir, int(cache_size * 1024 * 1024))
+		self.metagenome = metagenome
+		# batches of metagenome records are counted with window by a single process, without cache
+		if self.metagenome:
+			unused = [option for option, used in (('workers', self.workers > 1), ('chunk_size', self.chunk_size is not None),\
+			 ('pipeline', self.pipeline), ('cache_dir', self.cache is not None), ('prefilter', self.prefilter),\
+			 ('verify_prefilter', self.verify_prefilter), ('first_pass_engine', self.first_pass_engine == 'seed')) if used]
+			if unused:
+				print("Error: metagenome mode can't be used with options: %s." % ', '.join(unused))
+				sys.exit()
+		# chunks of records are counted with window
+		if self.first_pass_engine == 'seed' and self.chunk_size is not None and self.workers > 1:
+			print("Error: first pass engine 'seed' can't be used with chunked records.")
+			sys.exit()
+
 		# variables used to stock results during first pass
 
 		self.window_container = {}		# stocks association k-mer - count
@@ -113,27 +514,35 @@ class FindCRISPRs:
 
 		self.local_container = {}		# stocks association k-mer - count for 'interesting zone'
 		self.local_lookup_table = [] 		# k-mers in order
+		self.local_positions = {}		# association k-mer - positions in zone (see seed_index)
+		self.local_start = 0			# position of zone in sequence (0-based)
 		self.local_counts = []			# stocks k-mer counts in order
 		self.clusters = []			# list of clusters
 
 		self.CRISPRs = []			# list of CRISPR results for actually analyzed sequence
-		self.CRISPRs_all = [[] for i in range(len(self.fastas.fna_list))]
-		 # list of CRISPRs for all sequences in file
+		self.CRISPRs_all = []			# list of CRISPRs for all sequences in file
+		self.headers_all = []			# headers of analyzed sequences (same order as self.CRISPRs_all)
 		
 		# this method will initialize window container with k-mer occurences and positions
 		# once i == window_length/2, results are exported from dictionnary to self.k_mer_counts
 
-		# path to save outputted files
+		# path to save outputted files (output_path is extended by directory of each sequence)
 		self.output_path = output_path
+		self.output_root = output_path
 
 
-	def initiate_window(self, fasta_seq):
-		# fasta_seq is FastaSeq object
-		
+	# window can't be longer than sequence
+	def check_window_size(self, fasta_seq):
 		if len(fasta_seq.sequence) < self.window_size:
 			self.window_size = len(fasta_seq.sequence)
 			print("Warning, sequence is shorter than desired window length. Window length will be set to %d" %(len(fasta_seq.sequence)))
 
+
+	def initiate_window(self, fasta_seq):
+		# fasta_seq is FastaSeq object
+		
+		self.check_window_size(fasta_seq)
+
 		pos = 0
 		window_middle = int(self.window_size/2)
 		
@@ -202,6 +611,10 @@ class FindCRISPRs:
 		self.k_mer_counts = []
 		self.repeat_list_first_pass = []
 
+		# k-mers of encoded sequence are taken as bytes of codes (slicing bytes is faster than decoding)
+		if isinstance(fasta_seq.sequence, EncodedSeq):
+			fasta_seq = FastaSeq(fasta_seq.header, fasta_seq.sequence.codes.tobytes())
+
 		# initiate window
 		pos = self.initiate_window(fasta_seq)
 		# get counts for entire sequence
@@ -212,93 +625,530 @@ class FindCRISPRs:
 		self.finish(fasta_seq)
 
 
+	# generator giving k-mer counts of sequence one by one, in the same order and with the same 
+	# values as self.k_mer_counts filled by get_sequence_counts. Only k-mers of actual window are 
+	# kept: k-mers are coded as integers by rolling hash (exact, one character per 8 or 21 bits) 
+	# and stored in ring buffer, so memory doesn't depend on sequence length
+	def stream_sequence_counts(self, fasta_seq):
+		self.check_window_size(fasta_seq)
+
+		sequence = fasta_seq.sequence
+		if isinstance(sequence, EncodedSeq):
+			sequence = sequence.codes.tobytes()
+			symbols = sequence
+		else:
+			symbols = [ord(nucl) for nucl in sequence] if sequence and ord(max(sequence)) > 255 \
+			 else sequence.encode('latin-1')
+		bits = 21 if sequence and max(symbols) > 255 else 8
+
+		sequence_length = len(sequence)
+		window_middle = int(self.window_size/2)
+		ring_size = self.window_size + 1		# window holds one more k-mer when it's moving
+		ring = [0] * ring_size				# codes of k-mers of window
+		window_counts = {}				# association k-mer code - count in window
+		code_mask = (1 << (bits * self.k_mer_size)) - 1
+
+		code = 0
+		for i in range(0, min(self.k_mer_size - 1, sequence_length)):
+			code = (code << bits) | symbols[i]
+
+		for pos in range(0, sequence_length):
+			# k-mers at end of sequence are shorter, thus unique (negative code)
+			if pos + self.k_mer_size <= sequence_length:
+				code = ((code << bits) | symbols[pos + self.k_mer_size - 1]) & code_mask
+				key_code = code
+			else:
+				key_code = -1 - pos
+
+			ring[pos % ring_size] = key_code
+			window_counts[key_code] = window_counts.get(key_code, 0) + 1
+
+			if pos < self.window_size:
+				if pos >= window_middle:
+					yield window_counts[ring[(pos - window_middle) % ring_size]]
+			else:
+				yield window_counts[ring[(pos - window_middle) % ring_size]]
+
+				# remove k-mer leaving window
+				leaving_code = ring[(pos - self.window_size) % ring_size]
+				if window_counts[leaving_code] == 1:
+					del window_counts[leaving_code]
+				else:
+					window_counts[leaving_code] -= 1
+
+		for pos in range(sequence_length - window_middle, sequence_length):
+			yield window_counts[ring[pos % ring_size]]
+
+
+	# returns sequence (from start to end) as array of dense symbol codes (0 to alphabet size - 1) 
+	# for numpy computations
+	def sequence_codes(self, sequence, start = 0, end = None):
+		if isinstance(sequence, EncodedSeq):
+			return sequence.codes[start:end]
+		sequence = sequence[start:end]
+		try:
+			symbols = numpy.frombuffer(sequence.encode('latin-1'), dtype=numpy.uint8)
+		except UnicodeEncodeError:
+			return numpy.unique(numpy.frombuffer(sequence.encode('utf-32-le'), dtype=numpy.uint32), return_inverse=True)[1]
+		present = numpy.bincount(symbols, minlength=256) > 0
+		return (numpy.cumsum(present) - 1).astype(numpy.uint8)[symbols]
+
+
+	# sorts positions of sequence by k-mer and then by position, returns sorted positions and their 
+	# k-mer groups (positions have the same group number if and only if their k-mers are identical, 
+	# k-mers at end of sequence are shorter, thus unique)
+	def sort_k_mers(self, codes):
+		sequence_length = len(codes)
+		k_mer_number = max(sequence_length - self.k_mer_size + 1, 0)
+		if k_mer_number > 0:
+			# k-mers are cut in digits of 16 bits (several symbols per digit) and sorted digit by
+			# digit from the last one, stable sorts keep positions in ascending order
+			symbol_bits = max(int(codes.max()).bit_length(), 1)
+			digit_type = numpy.uint16 if symbol_bits <= 16 else numpy.uint32
+			per_digit = max((8 * numpy.dtype(digit_type).itemsize) // symbol_bits, 1)
+			digits = []
+			for digit_start in range(0, self.k_mer_size, per_digit):
+				digit = numpy.zeros(k_mer_number, dtype=digit_type)
+				for i in range(digit_start, min(digit_start + per_digit, self.k_mer_size)):
+					digit <<= symbol_bits
+					digit |= codes[i : i + k_mer_number].astype(digit_type)
+				digits.append(digit)
+
+			order = numpy.argsort(digits[-1], kind='mergesort')
+			for digit in digits[-2::-1]:
+				order = order[numpy.argsort(digit[order], kind='mergesort')]
+
+			changes = numpy.zeros(k_mer_number, dtype=bool)
+			for digit in digits:
+				sorted_digit = digit[order]
+				changes[1:] |= sorted_digit[1:] != sorted_digit[:-1]
+			sorted_groups = numpy.cumsum(changes, dtype=numpy.int64)
+			first_tail_group = sorted_groups[-1] + 1
+		else:
+			order = numpy.empty(0, dtype=numpy.int64)
+			sorted_groups = numpy.empty(0, dtype=numpy.int64)
+			first_tail_group = 0
+
+		tail_positions = numpy.arange(k_mer_number, sequence_length)
+		order = numpy.concatenate((order, tail_positions))
+		sorted_groups = numpy.concatenate((sorted_groups, tail_positions - k_mer_number + first_tail_group))
+		return order, sorted_groups
+
+
+	# first and last positions of windows in which k-mers at positions are counted (window is 
+	# centered on position, but shifted at extremities of sequence), as in get_sequence_counts
+	# window_size is self.window_size by default, sequence_length and window_size can be arrays 
+	# (one value per position)
+	def window_bounds(self, positions, sequence_length, window_size = None):
+		if window_size is None:
+			window_size = self.window_size
+		window_middle = window_size // 2
+		lo = numpy.maximum(numpy.minimum(positions, sequence_length - window_middle) + window_middle - window_size, 0)
+		hi = numpy.minimum(positions + window_middle, sequence_length - 1)
+		return lo, hi
+
+
+	# computes k-mer counts of positions start to end - 1 of sequence at once (same counts as 
+	# get_sequence_counts), only part of sequence covered by windows of these positions is read
+	def range_counts(self, sequence, start, end):
+		return self.part_counts(*self.range_part(sequence, start, end))
+
+
+	# codes of the part of sequence read by range_counts, with what part_counts needs to count
+	# them (a picklable task for chunk workers, smaller than whole sequence). Window size of
+	# sequence is part of task, window size of worker's finder is the one of its last record
+	def range_part(self, sequence, start, end):
+		sequence_length = len(sequence)
+		part_start = int(self.window_bounds(start, sequence_length)[0])
+		part_end = min(int(self.window_bounds(end - 1, sequence_length)[1]) + self.k_mer_size, sequence_length)
+		return self.sequence_codes(sequence, part_start, part_end), part_start, sequence_length, start, end, self.window_size
+
+
+	# k-mer counts of positions start to end - 1 from codes of the part of sequence beginning 
+	# at part_start, with windows of window_size
+	def part_counts(self, codes, part_start, sequence_length, start, end, window_size):
+		lo, hi = self.window_bounds(numpy.arange(part_start, part_start + len(codes)), sequence_length, window_size)
+		counts = self.bounded_counts(codes, numpy.maximum(lo - part_start, 0), numpy.minimum(hi - part_start, len(codes) - 1))
+		return counts[start - part_start : end - part_start]
+
+
+	# counts of k-mers of codes at every position within their window, given by its first (lo)
+	# and last (hi) positions
+	def bounded_counts(self, codes, lo, hi):
+		part_length = len(codes)
+
+		# positions sorted by (k-mer group, position): occurrences of the same k-mer are neighbours
+		order, sorted_groups = self.sort_k_mers(codes)
+		sorted_lo = lo[order]
+		sorted_hi = hi[order]
+
+		# k-mers having no neighbour occurrence in their window are counted once (most of them), 
+		# others are counted by binary search
+		repeated = numpy.zeros(part_length, dtype=bool)
+		same_group = sorted_groups[1:] == sorted_groups[:-1]
+		repeated[1:] |= same_group & (order[:-1] >= sorted_lo[1:])
+		repeated[:-1] |= same_group & (order[1:] <= sorted_hi[:-1])
+		sorted_counts = numpy.ones(part_length, dtype=numpy.int64)
+
+		repeated = numpy.flatnonzero(repeated)
+		if len(repeated):
+			sorted_keys = sorted_groups * (part_length + 1) + order
+			repeated_keys = sorted_groups[repeated] * (part_length + 1)
+			sorted_counts[repeated] = numpy.searchsorted(sorted_keys, repeated_keys + sorted_hi[repeated], side='right') -\
+			 numpy.searchsorted(sorted_keys, repeated_keys + sorted_lo[repeated], side='left')
+
+		counts = numpy.empty(part_length, dtype=numpy.int64)
+		counts[order] = sorted_counts
+		return counts
+
+
+	# computes k-mer counts of whole sequence at once
+	def vector_sequence_counts(self, fasta_seq):
+		self.window_container = {}
+		self.lookup_table = []
+		self.repeat_list_first_pass = []
+
+		self.check_window_size(fasta_seq)
+		self.k_mer_counts = self.range_counts(fasta_seq.sequence, 0, len(fasta_seq.sequence))
+
+
+	# positions of sequence whose k-mer may occur twice within window (all of them are found, some 
+	# aren't repeated). Each k-mer is sketched by its minimizer : its SKETCH_MINIMIZER_SIZE-mer with 
+	# lowest hash (first one in case of tie). Occurrences of the same k-mer have minimizers at the 
+	# same offset, so repeated k-mers have their minimizers repeated at the same distance, and only 
+	# minimizers (a fraction of positions) have to be compared
+	def sketch_candidates(self, sequence):
+		codes = self.sequence_codes(sequence)
+		sequence_length = len(codes)
+		size = min(SKETCH_MINIMIZER_SIZE, self.k_mer_size)
+		k_mer_number = sequence_length - self.k_mer_size + 1
+		candidates = numpy.zeros(sequence_length, dtype=bool)
+		if k_mer_number < 2:
+			return candidates
+
+		# values of s-mers (exact) and their hash
+		symbol_bits = max(int(codes.max()).bit_length(), 1)
+		value_type = numpy.uint16 if symbol_bits * size <= 16 else numpy.uint32 if symbol_bits * size <= 32 else numpy.uint64
+		s_mer_number = sequence_length - size + 1
+		values = numpy.zeros(s_mer_number, dtype=value_type)
+		for i in range(0, size):
+			values <<= value_type(symbol_bits)
+			values |= codes[i : i + s_mer_number].astype(value_type)
+		hashes = values * value_type(0x9E3779B1 & numpy.iinfo(value_type).max)
+
+		# minimizer of each k-mer, ties are given to first s-mer
+		lowest = hashes[0 : k_mer_number].copy()
+		minimizers = numpy.arange(k_mer_number)
+		for offset in range(1, self.k_mer_size - size + 1):
+			shifted = hashes[offset : offset + k_mer_number]
+			lower = shifted < lowest
+			lowest[lower] = shifted[lower]
+			minimizers[lower] = numpy.flatnonzero(lower) + offset
+
+		# minimizers with the same value within window, found as neighbours once sorted by (value, position)
+		sketched = numpy.zeros(sequence_length, dtype=bool)
+		sketched[minimizers] = True
+		sketch = numpy.flatnonzero(sketched)
+		order = numpy.argsort(values[sketch], kind='mergesort')
+		sorted_positions = sketch[order]
+		sorted_values = values[sorted_positions]
+		close = (sorted_values[1:] == sorted_values[:-1]) & (sorted_positions[1:] - sorted_positions[:-1] < self.window_size)
+		repeated = numpy.zeros(sequence_length, dtype=bool)
+		repeated[sorted_positions[1:][close]] = True
+		repeated[sorted_positions[:-1][close]] = True
+
+		candidates[:k_mer_number] = repeated[minimizers]
+		return candidates
+
+
+	# (start, end) ranges of sequence where k-mer counts decide zones of first pass. Repeats of 
+	# get_array_repeats are made of repeated positions, thus of candidates of sketch_candidates: 
+	# only runs of candidates long enough to be accepted repeat can open zone, and zone closes 
+	# within first_pass_limit after its last accepted repeat. Elsewhere, repeats can't change zones
+	def sketch_ranges(self, sequence):
+		sequence_length = len(sequence)
+		max_mismatch = self.allowed_mismatch + self.k_mer_size
+		candidates = numpy.flatnonzero(self.sketch_candidates(sequence))
+		if len(candidates) == 0:
+			return []
+		breaks = numpy.flatnonzero(numpy.diff(candidates) > max_mismatch)
+		starts = candidates[numpy.concatenate(([0], breaks + 1))]
+		ends = candidates[numpy.append(breaks, len(candidates) - 1)]
+		long_enough = self.k_mer_size + ends - starts + 1 > self.min_DR/2
+
+		margin = self.first_pass_limit + max_mismatch + self.k_mer_size + 1
+		range_starts = numpy.maximum(starts[long_enough] - margin, 0)
+		range_ends = numpy.minimum(ends[long_enough] + margin + 1, sequence_length)
+		ranges = []
+		for start, end in zip(range_starts.tolist(), range_ends.tolist()):
+			if ranges and start <= ranges[-1][1]:
+				ranges[-1][1] = max(ranges[-1][1], end)
+			else:
+				ranges.append([start, end])
+		return ranges
+
+
+	# k-mer counts of sequence computed by first_pass_engine only within ranges of sketch_ranges, 
+	# other k-mers are counted once. Each range is counted on part of sequence extended by window 
+	# on both sides, so that windows of its positions are the same as in whole sequence
+	def prefiltered_counts(self, fasta_seq):
+		self.check_window_size(fasta_seq)
+		sequence = fasta_seq.sequence
+		sequence_length = len(sequence)
+		counts = numpy.ones(sequence_length, dtype=numpy.int64)
+		for start, end in self.sketch_ranges(sequence):
+			if self.first_pass_engine == 'vector':
+				counts[start:end] = self.range_counts(sequence, start, end)
+				continue
+			part_start = max(start - self.window_size, 0)
+			part = FastaSeq(fasta_seq.header, sequence[part_start : min(end + self.window_size, sequence_length)])
+			if self.first_pass_engine == 'ring':
+				part_counts = list(self.stream_sequence_counts(part))
+			else:
+				self.get_sequence_counts(part)
+				part_counts = self.k_mer_counts
+			counts[start:end] = part_counts[start - part_start : end - part_start]
+		return counts
+
+
+	# first pass with k-mers counted only where sketch finds possible repeats
+	def prefiltered_first_pass(self, fasta_seq):
+		self.window_container = {}
+		self.lookup_table = []
+		self.k_mer_counts = self.prefiltered_counts(fasta_seq)
+		self.repeat_list_first_pass = []
+		self.get_repeats(fasta_seq)
+
+		if self.verify_prefilter:
+			zones = self.repeat_list_first_pass
+			self.repeat_list_first_pass = []
+			self.get_repeats(fasta_seq, self.range_counts(fasta_seq.sequence, 0, len(fasta_seq.sequence)))
+			if [(zone.begin, zone.end) for zone in zones] != [(zone.begin, zone.end) for zone in self.repeat_list_first_pass]:
+				print("Error: zones found with prefilter differ from those of whole sequence (%s)." % fasta_seq.header)
+				sys.exit()
+			self.repeat_list_first_pass = zones
+
+
+	# ranks of seeds (segments of depth symbols) of codes starting at positions 0 to 
+	# len(codes) - depth : equal seeds have the same rank, ranks are ordered as seeds. Symbols are 
+	# packed in integers as long as they fit, longer seeds are ranked by prefix doubling (rank of 
+	# two overlapping shorter seeds)
+	def seed_ranks(self, codes, depth):
+		symbol_bits = max(int(codes.max()).bit_length(), 1)
+		length = min(depth, 62 // symbol_bits)
+		prefix_number = len(codes) - length + 1
+		ranks = numpy.zeros(prefix_number, dtype=numpy.int64)
+		for i in range(0, length):
+			ranks <<= symbol_bits
+			ranks |= codes[i : i + prefix_number]
+
+		while length < depth:
+			shift = min(length, depth - length)
+			prefix_number -= shift
+			keys = numpy.stack((ranks[shift : shift + prefix_number], ranks[:prefix_number]))
+			order = numpy.lexsort(keys)
+			sorted_keys = keys[:, order]
+			changes = numpy.any(sorted_keys[:, 1:] != sorted_keys[:, :-1], axis=0)
+			ranks = numpy.empty(prefix_number, dtype=numpy.int64)
+			ranks[order] = numpy.cumsum(numpy.append(0, changes), dtype=numpy.int64)
+			length += shift
+		return ranks
+
+
+	# k-mer counts (2 for repeated k-mers, 1 otherwise) of seed engine. Positions are sorted by
+	# their exact seed (min_DR/2 bp, at least k-mer size, so that segment is long enough to be 
+	# accepted repeat of get_repeats), occurrences of a seed next to each other in this order and 
+	# at most DR and longest spacer apart are repeats, and k-mers of their seed segments are 
+	# repeated. Repeats longer than max_DR and shorter ones separated by mismatches are then 
+	# handled by get_repeats as with other engines. Counts aren't those of window (repeats are 
+	# found by distance, not within window), so zones can differ
+	def seed_sequence_counts(self, fasta_seq):
+		self.window_container = {}
+		self.lookup_table = []
+		self.repeat_list_first_pass = []
+
+		codes = self.sequence_codes(fasta_seq.sequence)
+		sequence_length = len(codes)
+		seed = max(int(self.min_DR/2), self.k_mer_size)
+		max_distance = self.max_DR + int(self.max_DR * self.max_spacer_DR_ratio)
+		self.k_mer_counts = numpy.ones(sequence_length, dtype=numpy.int64)
+		if sequence_length < seed:
+			return
+
+		# occurrences of the same seed sorted by position, close ones are repeats
+		ranks = self.seed_ranks(codes, seed)
+		order = numpy.argsort(ranks, kind='mergesort')
+		sorted_ranks = ranks[order]
+		close = (sorted_ranks[1:] == sorted_ranks[:-1]) & (order[1:] - order[:-1] <= max_distance)
+		repeated = numpy.zeros(sequence_length + 1, dtype=numpy.int64)
+		repeated[order[1:][close]] = 1
+		repeated[order[:-1][close]] = 1
+
+		# k-mers within seed segments of repeats
+		coverage = numpy.cumsum(repeated)
+		coverage[seed - self.k_mer_size + 1:] = coverage[seed - self.k_mer_size + 1:] - coverage[:sequence_length - seed + self.k_mer_size]
+		self.k_mer_counts[coverage[:sequence_length] > 0] = 2
+
+
 	# finds and returns expanded zones containing repeated segments in fasta_seq
-	def get_repeats(self, fasta_seq):
-		pos = 0
-		repeats = []
+	# counts are k-mer counts of sequence (self.k_mer_counts by default), they are read only once 
+	# in order, so any iterable (like stream_sequence_counts generator) can be used
+	# counts given as numpy array are processed by get_array_repeats
+	def get_repeats(self, fasta_seq, counts = None):
+		if counts is None:
+			counts = self.k_mer_counts
+		if isinstance(counts, numpy.ndarray):
+			self.get_array_repeats(fasta_seq, counts)
+			return
+		last_pos = len(fasta_seq.sequence) - 1
+
 		precursor_zone = 0			# indicates if inside of possible CRISPR precursor
 		precursor_start = 0			# start of CRISPR precursor 
 		precursor_end = 0			# end of CRISPR precursor
 		after_repeat_length = 0	 	# length of mismatched space after last repeat
-			
-		while pos < len(self.k_mer_counts):
+		in_repeat = False			# indicates if a repeat is being measured
+		consecutive_mismatch = 0		# number of mismatches found in row (not important if 0 or 1 mismatch allowed only, in other cases however...)
+		total_repeat_length = 0			# length of repeat (remember)
+
+		for pos, count in enumerate(counts):
+			# position may be examined twice: when repeat ends, its last position is examined again outside of repeat
+			while True:
+				if in_repeat:
+					# anytime there is a repeated sequence found, a search is made until either desired length is found (accepted) or number of mismatches is met (dismissed)
+					if consecutive_mismatch < (self.allowed_mismatch + self.k_mer_size) and pos < last_pos:
+						if count <= 1:
+							consecutive_mismatch += 1
+						else:
+							total_repeat_length = total_repeat_length + 1 + consecutive_mismatch
+							consecutive_mismatch = 0
+						break
+
+					in_repeat = False
+					if total_repeat_length > self.min_DR/2 and total_repeat_length < self.max_DR:
+						# if repeat is long enough (but not too long), we mark start of potential precursor to track next repeats
+						precursor_zone = 1
+						precursor_end = pos - consecutive_mismatch		# marks actual end of zone if repeat is sufficiently long
+						after_repeat_length = consecutive_mismatch		# new space between repats is defined by number of mismatches at the extremity
+					elif precursor_zone == 1:
+						after_repeat_length += total_repeat_length + consecutive_mismatch
+
+				elif count > 1 and pos < last_pos:
+					if precursor_zone == 0:				# only if we're not in repeat zone yet (ie. first repeat of local group)
+						precursor_start = pos			# where possible interesting zone containing repeat(s)
+					consecutive_mismatch = 0
+					total_repeat_length = self.k_mer_size
+					in_repeat = True
 
-			# anytime there is a repeated sequence found, a search is made until either desired length is found (accepted) or number of mismatches is met (dismissed)
-			# added case when 		
-			if self.k_mer_counts[pos] > 1 and pos < (len(self.k_mer_counts) - 1):
-				if precursor_zone == 0:				# only if we're not in repeat zone yet (ie. first repeat of local group)
-					precursor_start = pos			# where possible interesting zone containing repeat(s)
-					
-				consecutive_mismatch = 0			# number of mismatches found in row (not important if 0 or 1 mismatch allowed only, in other cases however...)
-				total_repeat_length = self.k_mer_size		# length of repeat (remember)
-				
-				while consecutive_mismatch < (self.allowed_mismatch + self.k_mer_size)\
-				 and pos < (len(self.k_mer_counts) - 1):
-					if self.k_mer_counts[pos] <= 1:
-						consecutive_mismatch += 1
-						
-					else:
-						total_repeat_length = total_repeat_length + 1 + consecutive_mismatch
-						consecutive_mismatch = 0
-						
-					pos += 1
-				
-				if total_repeat_length > self.min_DR/2 and total_repeat_length < self.max_DR:
-					# if repeat is long enough (but not too long), we mark start of potential precursor to track next repeats
-					precursor_zone = 1
-					precursor_end = pos - consecutive_mismatch		# marks actual end of zone if repeat is sufficiently long
-					after_repeat_length = consecutive_mismatch		# new space between repats is defined by number of mismatches at the extremity
-					
 				else:
 					if precursor_zone == 1:
-						after_repeat_length += total_repeat_length + consecutive_mismatch
-			
-			else:
-				if precursor_zone == 1:
-					# if space without repeats is longer than allowed or the sequence is ending, export repeat
-					if after_repeat_length >= self.first_pass_limit or pos == len(self.k_mer_counts) - 1:
-						self.repeat_list_first_pass.append(\
-						 Repeat(fasta_seq.sequence[precursor_start : (precursor_end+self.k_mer_size-1)],\
-						 precursor_start, precursor_end + self.k_mer_size-1))
+						# if space without repeats is longer than allowed or the sequence is ending, export repeat
+						if after_repeat_length >= self.first_pass_limit or pos == last_pos:
+							self.repeat_list_first_pass.append(\
+							 Repeat(fasta_seq.sequence, precursor_start + 1, precursor_end + self.k_mer_size-1, precursor_start))
 
-						precursor_zone = 0				# once saved we search for next extended zone with repeats
-						after_repeat_length = 0			# we leave zone in proximity of repeats (defined by self.first_pass_limit)
+							precursor_zone = 0				# once saved we search for next extended zone with repeats
+							after_repeat_length = 0			# we leave zone in proximity of repeats (defined by self.first_pass_limit)
 
-					else:
-						after_repeat_length += 1
-					
-				pos += 1
+						else:
+							after_repeat_length += 1
+					break
+
+
+	# same zones as get_repeats, computed on whole array of counts:
+	#	-	repeats are runs of positions with count > 1 separated by less than 
+	#		 allowed_mismatch + k_mer_size positions with count 1
+	#	-	repeat exits after this number of mismatches (or at end of sequence), repeats with length 
+	#		 between min_DR/2 and max_DR open (or extend) a zone, others only lengthen the space 
+	#		 after last accepted repeat by k_mer_size
+	#	-	zone is closed at first position outside of repeats where space after last accepted 
+	#		 repeat reaches first_pass_limit, or at end of sequence
+	def get_array_repeats(self, fasta_seq, counts):
+		last_pos = len(counts) - 1
+		max_mismatch = self.allowed_mismatch + self.k_mer_size
+
+		# repeats (runs of repeated positions)
+		repeated = numpy.flatnonzero(counts[:max(last_pos, 0)] > 1)
+		if len(repeated) == 0:
+			return
+		breaks = numpy.flatnonzero(numpy.diff(repeated) > max_mismatch)
+		starts = repeated[numpy.concatenate(([0], breaks + 1))]
+		ends = repeated[numpy.concatenate((breaks, [len(repeated) - 1]))]
+
+		exits = numpy.minimum(ends + max_mismatch + 1, last_pos)		# where repeat measure stops
+		lengths = self.k_mer_size + ends - starts + 1
+		accepted = (lengths > self.min_DR/2) & (lengths < self.max_DR)
+
+		# last accepted repeat before each repeat, and space after it at exit of repeat
+		accepted_index = numpy.flatnonzero(accepted)
+		if len(accepted_index) == 0:
+			return
+		last_accepted = numpy.maximum.accumulate(numpy.where(accepted, numpy.arange(len(starts)), -1))
+		rejected_count = numpy.cumsum(~accepted)
+		in_zone = last_accepted >= 0
+		last_accepted = numpy.maximum(last_accepted, 0)
+		space = exits - ends[last_accepted] - 1 +\
+		 self.k_mer_size * (rejected_count - rejected_count[last_accepted])
+
+		# zone closes after repeat if space reaches limit before next repeat (or at end of sequence)
+		gap_ends = numpy.append(starts[1:] - 1, last_pos)
+		closing = in_zone & (gap_ends >= exits) & ((space + gap_ends - exits >= self.first_pass_limit) |\
+		 (gap_ends == last_pos))
+
+		# only first closing after last accepted repeat is effective, zone then starts at first 
+		# accepted repeat after previous closing
+		closing = numpy.flatnonzero(closing)
+		closing = closing[numpy.append(True, last_accepted[closing[1:]] != last_accepted[closing[:-1]])]
+		opening = accepted_index[numpy.searchsorted(accepted_index, numpy.append(-1, closing[:-1]), side='right')]
+
+		for zone_start, zone_end in zip(starts[opening].tolist(), (ends[last_accepted[closing]] + self.k_mer_size).tolist()):
+			self.repeat_list_first_pass.append(Repeat(fasta_seq.sequence, zone_start + 1, zone_end, zone_start))
 
 
 	# uses sliding window and then searches for regions with repeats
 	def first_pass (self, fasta_seq):
-		self.get_sequence_counts(fasta_seq)
-		self.get_repeats(fasta_seq)
+		if self.first_pass_engine == 'seed':
+			self.seed_sequence_counts(fasta_seq)
+			self.get_repeats(fasta_seq)
+		elif self.prefilter:
+			self.prefiltered_first_pass(fasta_seq)
+		elif self.first_pass_engine == 'ring':
+			self.window_container = {}
+			self.lookup_table = []
+			self.k_mer_counts = []
+			self.repeat_list_first_pass = []
+			self.get_repeats(fasta_seq, self.stream_sequence_counts(fasta_seq))
+		elif self.first_pass_engine == 'vector':
+			self.vector_sequence_counts(fasta_seq)
+			self.get_repeats(fasta_seq)
+		else:
+			self.get_sequence_counts(fasta_seq)
+			self.get_repeats(fasta_seq)
 		
 
 	# counts repeats locally using other pattern more friendly to mismatches. Precises CRISPRs
 	def get_pattern_counts (self, repeat):
-		# reset stocking tables
-		self.local_container = {}
-		self.local_lookup_table = []
-		self.local_counts = []
+		# seeds of every position of repeat, their counts, and count of seed for each position
+		self.local_lookup_table = self.pattern.extract_patterns(repeat.sequence)
+		self.local_container = collections.Counter(self.local_lookup_table)
+		self.local_counts = [self.local_container[patt] for patt in self.local_lookup_table]
+		self.local_positions = {}
+		self.local_start = repeat.begin - 1
 		self.repeat_list_second_pass = []
-		
-		pos = 0
-		while pos<len(repeat):
-			key_sequence = self.pattern.extract_pattern(repeat.sequence, pos)
-			self.local_lookup_table.append(key_sequence)
-	
-			if key_sequence in self.local_container:
-				self.local_container[key_sequence][0] = self.local_container[key_sequence][0]+1		# update count
-				self.local_container[key_sequence][1].append(pos)					# update list of positions
-			else:
-				self.local_container[key_sequence] = [1, [pos]]
 
-			pos += 1
-	
-		for patt in self.local_lookup_table:
-			self.local_counts.append(self.local_container[patt][0])
+
+	# positions (in ascending order) of seed in zone, indexed once for all clusters of zone
+	def seed_index (self, seed):
+		if seed not in self.local_positions:
+			positions = []
+			try:
+				pos = self.local_lookup_table.index(seed)
+				while True:
+					positions.append(pos)
+					pos = self.local_lookup_table.index(seed, pos + 1)
+			except ValueError:
+				pass
+			self.local_positions[seed] = positions
+		return self.local_positions[seed]
 		
 
 	# extracts direct repeats for sequences and stocks them into clusters
@@ -310,7 +1160,8 @@ class FindCRISPRs:
 		max_kmer_exported = 0			# indicates if maximum kmer was exported (in case if repeat turns out to be false - not short or long enough)
 		max_kmer_info = []	
 		
-		repeat_start = repeat.begin		# true starting position of repeat (needed to offset local position pos)	
+		zone_sequence = repeat.sequence
+		repeat_start = repeat.begin - 1		# true starting position of repeat (needed to offset local position pos)	
 		max_value = max(self.local_counts)	# maximum number of repeats in table
 		threshold_value = round(max_value*self.threshold)	# limit value to distinguish repeats and unique zones (though unique should mean 1)	
 		if threshold_value < 2:
@@ -351,7 +1202,7 @@ class FindCRISPRs:
 							else:
 								actual_repeat = len(self.clusters[-1])
 								
-							max_kmer_info = [self.pattern.extract_pattern(repeat.sequence, pos), actual_repeat, DR_pos]
+							max_kmer_info = [self.local_lookup_table[pos], actual_repeat, DR_pos]
 							
 					pos += 1
 					DR_pos += 1						
@@ -359,12 +1210,12 @@ class FindCRISPRs:
 				if total_repeat_length >= self.min_DR and total_repeat_length <= self.max_DR:
 
 					if in_cluster == 0:
-						self.clusters.append(Cluster())	
+						self.clusters.append(Cluster(len(self.clusters) + 1))	
 						in_cluster = 1					
 					
 					spacer_length = consecutive_mismatch
 					repeat_ending_pos = repeat_starting_pos + total_repeat_length
-					self.clusters[-1].add_repeat(Repeat(repeat.sequence[repeat_starting_pos:repeat_ending_pos], repeat_start + repeat_starting_pos + 1, repeat_start + repeat_ending_pos))	
+					self.clusters[-1].add_repeat(Repeat(zone_sequence[repeat_starting_pos:repeat_ending_pos], repeat_start + repeat_starting_pos + 1, repeat_start + repeat_ending_pos))	
 					if max_kmer_found == 1 and max_kmer_exported == 0:	# kmer was found but not exported yet
 			
 						max_kmer_exported = 1
@@ -406,24 +1257,19 @@ class FindCRISPRs:
 		ref_number = cluster.most_repeated[1]			# number of reference repeat
 		ref_seed_pos = cluster.most_repeated[2]			# position of most frequent sequence
 
-		seed_found = 0						# indicates if seed was found for given repeat
-
 		seed_positions = [ref_seed_pos]				# position at which the seeds start
+		zone_positions = self.seed_index(seed_seq)		# positions of seed in zone
 		
 		comp_number = ref_number + 1				# sequence to compare
 		while comp_number < len(cluster):
 			
-			seed_found = 0
-			comp_seed_pos = 0
-			while comp_seed_pos < (len(cluster.repeats[comp_number].sequence) - self.pattern.n_symbols) and seed_found == 0:
-				if seed_seq == self.pattern.extract_pattern(cluster.repeats[comp_number].sequence, comp_seed_pos):
-					seed_found = 1	
-					seed_positions.append(comp_seed_pos)
-					break
-				
-				comp_seed_pos += 1
-
-			if seed_found == 0:
+			# first position of seed in repeat (repeats are parts of zone, seeds must be complete)
+			comp_start = cluster.repeats[comp_number].begin - 1 - self.local_start
+			comp_end = comp_start + max(len(cluster.repeats[comp_number]) - self.pattern.n_symbols, 0)
+			index = bisect.bisect_left(zone_positions, comp_start)
+			if index < len(zone_positions) and zone_positions[index] < comp_end:
+				seed_positions.append(zone_positions[index] - comp_start)
+			else:
 				seed_positions.append(-1)
 
 			comp_number += 1
@@ -490,11 +1336,10 @@ class FindCRISPRs:
 				# ^ -1 is because cluster.repeats[x].begin is defined as position in sequence, not in list
 					before_seed -= 1
 					# determine the column of supposedly aligned nucleotides, then calculate mismatches
-					extend_nucls_before = [fasta_seq.sequence[cluster.repeats[x].begin +\
-					 seed_positions[x] + before_seed - 1] for x in range(0, len(cluster))]
+					extend_nucls_before = self.nucleotide_column(fasta_seq.sequence, [cluster.repeats[x].begin +\
+					 seed_positions[x] + before_seed - 1 for x in range(0, len(cluster))])
 					[mismatches, max_counts] = self.count_mismatches(extend_nucls_before)
 					# if either percentage or number of mismatches is lower than limit, extend
-					most_frequent = max(set(extend_nucls_before), key = extend_nucls_before.count)
 					if (len(extend_nucls_before) - max_counts) <= self.identity_limit or mismatches < column_mismatch_limit:
 						total_mismatch_count_left += mismatches
 						consecutive_mismatch_before = 0
@@ -523,12 +1368,11 @@ class FindCRISPRs:
 				# ^ -2 because of string -> list conversion (-1) and since we want to add self.pattern.n_symbols - 1		
 					after_seed += 1
 					# determine the column of supposedly aligned nucleotides, then calculate mismatches 			
-					extend_nucls_after = [fasta_seq.sequence[cluster.repeats[x].begin +\
-					 seed_positions[x] + self.pattern.n_symbols + after_seed - 2]\
-					 for x in range(0, len(cluster))]	
+					extend_nucls_after = self.nucleotide_column(fasta_seq.sequence, [cluster.repeats[x].begin +\
+					 seed_positions[x] + self.pattern.n_symbols + after_seed - 2\
+					 for x in range(0, len(cluster))])
 					[mismatches, max_counts] = self.count_mismatches(extend_nucls_after)
 					# if either percentage or number of mismatches is lower than limit, extend
-					most_frequent = max(set(extend_nucls_after), key = extend_nucls_after.count)
 					if (len(extend_nucls_after) - max_counts) <= self.identity_limit or mismatches < column_mismatch_limit:		
 						total_mismatch_count_right += mismatches
 						consecutive_mismatch_after = 0
@@ -554,15 +1398,28 @@ class FindCRISPRs:
 			for i in range(0, len(cluster)):
 				new_begin = cluster.repeats[i].begin + seed_positions[i] + before_seed
 				new_end = cluster.repeats[i].begin + seed_positions[i] + self.pattern.n_symbols + after_seed - 1
-				new_sequence = fasta_seq.sequence[(new_begin - 1) : (new_end)]
-				new_repeat = Repeat(new_sequence, new_begin, new_end)
+				new_repeat = Repeat(fasta_seq.sequence, new_begin, new_end, new_begin - 1)
 				cluster.modify_repeat(new_repeat, i)
 				
 				
+	# returns nucleotides of sequence at given positions, as array of codes for encoded sequences
+	def nucleotide_column(self, sequence, positions):
+		if isinstance(sequence, EncodedSeq):
+			return sequence.codes[positions]
+		return [sequence[position] for position in positions]
+
+
 	# compares nucleotides while remembering last actual state, i.e. number of mismatches is
 	# number of state changes (ie. A A C C C has single mismatch - A->C transition
-	# nucl column is a column of supposedly aligned nucleotides
+	# nucl column is a column of supposedly aligned nucleotides (list of characters or array of codes)
 	def count_mismatches(self, nucl_column):
+		if isinstance(nucl_column, numpy.ndarray):
+			# codes are already case normalized, N are mismatches and do not change state
+			states = nucl_column[nucl_column != N_CODE]
+			num_mismatch = len(nucl_column) - len(states) + numpy.count_nonzero(states[1:] != states[:-1])
+			max_count = numpy.bincount(states, minlength=4)[:4].max()
+			return (int(num_mismatch), int(max_count))
+
 		last_state = ''
 		state_counts = {'A':0, 'C':0, 'G':0, 'T':0}
 					
@@ -592,15 +1449,26 @@ class FindCRISPRs:
 
 	# uses specific pattern to precise precursor repeats from first pass, regroup them into clusters, then align them	
 	def second_pass (self, fasta):
-		# get clusters
+		clusters = []
 		for repeat in self.repeat_list_first_pass:
-			self.get_pattern_counts(repeat)
-			self.extract_clusters(repeat)
+			clusters.extend(self.zone_clusters(repeat, fasta))
+		self.clusters = clusters
+
+
+	# returns clusters of one zone of first pass (zones are independent of each other)
+	def zone_clusters (self, repeat, fasta):
+		self.clusters = []
+
+		# get clusters
+		self.get_pattern_counts(repeat)
+		self.extract_clusters(repeat)
 					
 		# align and extend DRs
 		for cluster in reversed(self.clusters):
 			seed_pos = self.align_seeds (cluster)
 			self.extend (cluster, seed_pos, fasta)
+
+		return self.clusters
 			
 
 	# verifies parameter for each cluster (length of DR, length of spacer)
@@ -647,45 +1515,43 @@ class FindCRISPRs:
 		self.search_DR_before(fasta, CRISPR1, CRISPR2, startpos, endpos)
 					
 				
-	# search recursively for consensus after CRISPR
+	# search for consensus before CRISPR, DR by DR
 	def search_DR_before(self, fasta, CRISPR1, CRISPR2, startpos, endpos):
-		startpos = int(startpos)
-		endpos = int(endpos)
-		interspace_filled = False
-		last_DR_begin = CRISPR1.begin
-		
-		# if at start of sequence, quit
-		if endpos < 0:
-			return
-				
-		# okay if space between two consecutive CRISPRs is smaller
-		if CRISPR2 is not None:
-			if (last_DR_begin - CRISPR2.end) <= len(CRISPR1.DR_consensus) *\
-			 self.max_spacer_DR_ratio:
-				if(self.compare_DRs(CRISPR1.DR_consensus, CRISPR2.DR_consensus, 2)):
-					for DR in reversed(CRISPR2.DR):
-					# fuse this and next spacer					
-						CRISPR1.insert_DR(DR, fasta, 0)
-
-					self.CRISPRs.remove(CRISPR2)
-				
+		while True:
+			startpos = int(startpos)
+			endpos = int(endpos)
+			last_DR_begin = CRISPR1.begin
+			
+			# if at start of sequence, quit
+			if endpos < 0:
 				return
-		
-		# check for next DR
-		i = startpos
-		while i>endpos:
-			if self.compare_DRs(fasta.sequence[(i-len(CRISPR1.DR_consensus)):i],\
-			 CRISPR1.DR_consensus, 2):
-				coords = [(i-len(CRISPR1.DR_consensus)), i]
-				newDR = Repeat(fasta.sequence[coords[0]:coords[1]],\
-				 (coords[0]+1), (coords[1]+1))
-				startpos = i - len(CRISPR1.DR_consensus)*(1+self.min_spacer_DR_ratio)
-				endpos = i - len(CRISPR1.DR_consensus)*(1+self.max_spacer_DR_ratio)
-				CRISPR1.insert_DR(newDR, fasta, 0)
-				self.search_DR_before(fasta, CRISPR1, CRISPR2, startpos, endpos)
-				break
+					
+			# okay if space between two consecutive CRISPRs is smaller
+			if CRISPR2 is not None:
+				if (last_DR_begin - CRISPR2.end) <= len(CRISPR1.DR_consensus) *\
+				 self.max_spacer_DR_ratio:
+					if(self.compare_DRs(CRISPR1.DR_consensus, CRISPR2.DR_consensus, 2)):
+						for DR in reversed(CRISPR2.DR):
+						# fuse this and next spacer					
+							CRISPR1.insert_DR(DR, fasta, 0)
+
+						self.CRISPRs.remove(CRISPR2)
+					
+					return
 			
-			i -= 1
+			# check for next DR: closest one to CRISPR ending between endpos (excluded) and startpos
+			DR_length = len(CRISPR1.DR_consensus)
+			hits = self.find_DRs(fasta.sequence, CRISPR1.DR_consensus, endpos + 1 - DR_length, startpos - DR_length, 2)
+			if len(hits) == 0:
+				return
+
+			i = int(hits[-1]) + DR_length
+			coords = [(i-DR_length), i]
+			newDR = Repeat(fasta.sequence[coords[0]:coords[1]],\
+			 (coords[0]+1), (coords[1]+1))
+			startpos = i - DR_length*(1+self.min_spacer_DR_ratio)
+			endpos = i - DR_length*(1+self.max_spacer_DR_ratio)
+			CRISPR1.insert_DR(newDR, fasta, 0)
 			
 	
 	# searches for repeats after CRISPR which could be missed due to 
@@ -700,50 +1566,75 @@ class FindCRISPRs:
 		 CRISPR2, startpos, endpos)
 					
 				
-	# search recursively for consensus after CRISPR
+	# search for consensus after CRISPR, DR by DR
 	def search_DR_after(self, fasta, CRISPR1, CRISPR2, startpos, endpos):
-		startpos = int(startpos)
-		endpos = int(endpos)
-		
-		# if at end of sequence, quit
-		if endpos > len(fasta.sequence):
-			return
-		
-		interspace_filled = False
-		last_DR_end = CRISPR1.end
-				
-		# okay if space between two consecutive CRISPRs is smaller
-		if CRISPR2 is not None:
-			if (CRISPR2.begin - last_DR_end) <= len(CRISPR1.DR_consensus) *\
-			 self.max_spacer_DR_ratio:
-				if(self.compare_DRs(CRISPR1.DR_consensus, CRISPR2.DR_consensus, 2)):
-					for DR in CRISPR2.DR:
-					# fuse this and next spacer					
-						CRISPR1.insert_DR(DR, fasta)
-						
-					self.CRISPRs.remove(CRISPR2)
-				
+		while True:
+			startpos = int(startpos)
+			endpos = int(endpos)
+			
+			# if at end of sequence, quit
+			if endpos > len(fasta.sequence):
 				return
-		
-		# check for next DR
-		i = startpos
-		while i<endpos:
-			if self.compare_DRs(fasta.sequence[i:(i+len(CRISPR1.DR_consensus))],\
-			 CRISPR1.DR_consensus, 2):
-				coords = [i,(i+len(CRISPR1.DR_consensus))]
-				newDR = Repeat(fasta.sequence[coords[0]:coords[1]],\
-				 (coords[0]+1), (coords[1]+1))
-				startpos = i + len(CRISPR1.DR_consensus)*(1+self.min_spacer_DR_ratio)
-				endpos = i + len(CRISPR1.DR_consensus)*(1+self.max_spacer_DR_ratio)
-				CRISPR1.insert_DR(newDR, fasta)
-				self.search_DR_after(fasta, CRISPR1, CRISPR2, startpos, endpos)
-				break
 			
-			i += 1
+			last_DR_end = CRISPR1.end
+					
+			# okay if space between two consecutive CRISPRs is smaller
+			if CRISPR2 is not None:
+				if (CRISPR2.begin - last_DR_end) <= len(CRISPR1.DR_consensus) *\
+				 self.max_spacer_DR_ratio:
+					if(self.compare_DRs(CRISPR1.DR_consensus, CRISPR2.DR_consensus, 2)):
+						for DR in CRISPR2.DR:
+						# fuse this and next spacer					
+							CRISPR1.insert_DR(DR, fasta)
+							
+						self.CRISPRs.remove(CRISPR2)
+					
+					return
 			
+			# check for next DR: closest one to CRISPR starting between startpos and endpos (excluded)
+			DR_length = len(CRISPR1.DR_consensus)
+			hits = self.find_DRs(fasta.sequence, CRISPR1.DR_consensus, startpos, endpos - 1, 2)
+			if len(hits) == 0:
+				return
+
+			i = int(hits[0])
+			coords = [i,(i+DR_length)]
+			newDR = Repeat(fasta.sequence[coords[0]:coords[1]],\
+			 (coords[0]+1), (coords[1]+1))
+			startpos = i + DR_length*(1+self.min_spacer_DR_ratio)
+			endpos = i + DR_length*(1+self.max_spacer_DR_ratio)
+			CRISPR1.insert_DR(newDR, fasta)
 			
-	# compares two sequences with certain tolerance	
+			
+	# returns starting positions (ascending) of segments of sequence differing from consensus at 
+	# most in tolerance characters, for segments starting from first to last position. All segments 
+	# are compared at once (array of shifted views of sequence against consensus)
+	def find_DRs(self, sequence, consensus, first, last, tolerance):
+		first = max(first, 0)
+		last = min(last, len(sequence) - len(consensus))
+		if last < first:
+			return numpy.empty(0, dtype=numpy.int64)
+
+		region = self.character_codes(sequence[first : last + len(consensus)])
+		segments = numpy.lib.stride_tricks.as_strided(region, shape = (last - first + 1, len(consensus)),\
+		 strides = (region.strides[0], region.strides[0]))
+		mismatches = (segments != self.character_codes(consensus)).sum(axis = 1)
+		return numpy.flatnonzero(mismatches <= tolerance) + first
+
+
+	# returns characters of text as array of their codes
+	def character_codes(self, text):
+		try:
+			return numpy.frombuffer(text.encode('latin-1'), dtype=numpy.uint8)
+		except UnicodeEncodeError:
+			return numpy.frombuffer(text.encode('utf-32-le'), dtype=numpy.uint32)
+
+
+	# compares two sequences (strings or arrays of codes) with certain tolerance	
 	def	compare_DRs(self, sequence1, sequence2, tolerance):
+		if isinstance(sequence1, numpy.ndarray) and isinstance(sequence2, numpy.ndarray):
+			return len(sequence1) == len(sequence2) and numpy.count_nonzero(sequence1 != sequence2) <= tolerance
+
 		errors = 0
 		if len(sequence1) == len(sequence2):
 			for i in range(len(sequence1)):
@@ -784,45 +1675,27 @@ class FindCRISPRs:
 			search_range_end = crispr.DR[0].begin - DR_length * (self.max_spacer_DR_ratio + 1)
 			if search_range_end < 0:
 				search_range_end = 0
+			lower_limit = crispr.DR[0].begin - DR_length * self.max_spacer_DR_ratio
+			upper_limit = crispr.DR[0].begin - DR_length * self.min_spacer_DR_ratio
 				
 			fragment = 0
 			while (fragment + fragment_len) < len(crispr.DR[0]) and DR_found == False:
-				pos = crispr.DR[0].begin - 1
-				while pos > search_range_end and DR_found == False:
+				# fragment ends at pos, between search_range_end (excluded) and start of first DR (closest first)
+				for pos in reversed(self.fragment_ends(fasta, crispr.DR[0].sequence[fragment:(fragment+fragment_len)],\
+				 int(search_range_end) + 1, crispr.DR[0].begin - 1)):
 					DR_start = pos - fragment_len - fragment + 1
 					DR_end = pos - fragment_len - fragment + len(crispr.DR[0])
-					lower_limit = crispr.DR[0].begin - DR_length * self.max_spacer_DR_ratio
-					upper_limit = crispr.DR[0].begin - DR_length * self.min_spacer_DR_ratio
-					if (crispr.DR[0].sequence[fragment:(fragment+fragment_len)] ==\
-					 fasta.sequence[(pos - fragment_len) : pos]) and DR_end > lower_limit and DR_end < upper_limit:
+					if DR_end > lower_limit and DR_end < upper_limit:
 						# checking if supposed start of DR is starting in sequence
 						if (pos - fragment) > 0 :
+							DR, similarity, identity_switch, last_position_status = self.compare_truncated(crispr.DR[0].sequence,\
+							 fasta, pos - fragment_len - fragment, last_position_status)
 							DR_found = True
-							DR = ""
-							similarity = 0.0
-							identity_switch = 0.0 
-							for i in range(0, len(crispr.DR[0])):
-								# calculating similarity and number of changes between mismatch - identity and vice versa status
-								if crispr.DR[0].sequence[i] == fasta.sequence[pos - fragment_len - fragment + i]:
-									similarity += 1
-									if last_position_status == 0:
-										identity_switch += 1
-										
-									last_position_status = 1
-								else:
-									if last_position_status == 1:
-										identity_switch += 1
-										
-									last_position_status = 0		
-									
-								DR+=fasta.sequence[pos - fragment_len - fragment + i]
-								
-							similarity /= len(crispr.DR[0])	
-							identity_switch /= (len(crispr.DR[0]) - 1)
 							if similarity <= self.identity_truncated and identity_switch >= switch_limit: 	# continue searching if conditions aren't respected
 								DR_found = False
+							else:
+								break
 											
-					pos -= 1	
 				fragment += fragment_len			 
 
 		elif direction == 1:
@@ -831,38 +1704,24 @@ class FindCRISPRs:
 			search_range_end = crispr.DR[-1].end + DR_length * (self.max_spacer_DR_ratio + 1)
 			if search_range_end > len(fasta.sequence):
 				search_range_end = 0
+			lower_limit = crispr.DR[-1].end + DR_length * self.min_spacer_DR_ratio
+			upper_limit = crispr.DR[-1].end + DR_length * self.max_spacer_DR_ratio
 			fragment = 0
 			while (fragment + fragment_len) < len(crispr.DR[0]) and DR_found == False:
-				pos = crispr.DR[-1].end
-				while pos < search_range_end and DR_found == False:
+				# fragment starts at pos, between end of last DR and search_range_end (excluded)
+				for pos in self.fragment_starts(fasta, crispr.DR[-1].sequence[fragment:(fragment+fragment_len)],\
+				 crispr.DR[-1].end, int(math.ceil(search_range_end)) - 1):
 					DR_start = pos - fragment + 1
 					DR_end = pos - fragment + len(crispr.DR[-1])
-					lower_limit = crispr.DR[-1].end + DR_length * self.min_spacer_DR_ratio
-					upper_limit = crispr.DR[-1].end + DR_length * self.max_spacer_DR_ratio
-					if (crispr.DR[-1].sequence[fragment:(fragment+fragment_len)] ==\
-					 fasta.sequence[pos : (pos + fragment_len)]) and DR_start > lower_limit and DR_start < upper_limit:
+					if DR_start > lower_limit and DR_start < upper_limit:
 						if (pos + len(crispr.DR[-1]) - fragment) < len(fasta.sequence):
+							DR, similarity, identity_switch, last_position_status = self.compare_truncated(crispr.DR[-1].sequence,\
+							 fasta, pos - fragment, last_position_status)
 							DR_found = True
-							DR = ""
-							similarity = 0.0
-							identity_switch = 0.0
-							for i in range(0, len(crispr.DR[-1])):
-								if crispr.DR[-1].sequence[i] == fasta.sequence[pos - fragment + i]:
-									similarity += 1
-									if last_position_status == 0:
-										identity_switch += 1
-									last_position_status = 1
-								else:
-									if last_position_status == 1:
-										identity_switch += 1
-									last_position_status = 0
-								DR+=fasta.sequence[pos - fragment + i]
-								
-							similarity /= len(crispr.DR[-1])
-							identity_switch /= len(crispr.DR[-1]) - 1
 							if similarity <= self.identity_truncated and identity_switch >= switch_limit:		# continue searching if conditions aren't respected
 								DR_found = False
-					pos += 1
+							else:
+								break
 						
 				fragment += fragment_len
 				
@@ -874,6 +1733,57 @@ class FindCRISPRs:
 				crispr.insert_DR(Repeat(DR, DR_start, DR_end), fasta, 0)
 
 	
+	# returns positions (ascending) from first to last where fragment starts in sequence of fasta
+	# (occurrences are found by str.find in this part of sequence only)
+	def fragment_starts(self, fasta, fragment, first, last):
+		first = max(first, 0)
+		if last < first:
+			return []
+		if len(fragment) == 0:
+			return list(range(first, last + 1))
+
+		region = fasta.sequence[first : last + len(fragment)]
+		positions = []
+		found_at = region.find(fragment)
+		while found_at != -1:
+			positions.append(first + found_at)
+			found_at = region.find(fragment, found_at + 1)
+		return positions
+
+
+	# returns positions (ascending) from first to last where fragment ends in sequence of fasta
+	def fragment_ends(self, fasta, fragment, first, last):
+		return [start + len(fragment) for start in self.fragment_starts(fasta, fragment, first - len(fragment), last - len(fragment))]
+
+
+	# compares DR with segment of sequence of fasta starting at start, returns the segment, fraction
+	# of identic positions, fraction of alternations between identity and mismatch (status of last
+	# compared position is given and returned, it is carried from one comparison to next one)
+	def compare_truncated(self, DR_sequence, fasta, start, last_position_status):
+		DR = ""
+		similarity = 0.0
+		identity_switch = 0.0 
+		for i in range(0, len(DR_sequence)):
+			# calculating similarity and number of changes between mismatch - identity and vice versa status
+			if DR_sequence[i] == fasta.sequence[start + i]:
+				similarity += 1
+				if last_position_status == 0:
+					identity_switch += 1
+					
+				last_position_status = 1
+			else:
+				if last_position_status == 1:
+					identity_switch += 1
+					
+				last_position_status = 0		
+				
+			DR += fasta.sequence[start + i]
+			
+		similarity /= len(DR_sequence)	
+		identity_switch /= (len(DR_sequence) - 1)
+		return DR, similarity, identity_switch, last_position_status
+
+
 	# checks crispr for nucleotide composition and erases them if they present strong nucleotide bias (low complexity region)
 	# returns 1 if crispr was not deleted and 0 otherwise, as to not check in next filter if it doesn't exist anymore
 	def filter_low_complexity(self, crispr):
@@ -918,23 +1828,19 @@ class FindCRISPRs:
 		
 		# we compare segments of spacer with both DRs if CRISPR has only 2 DRs (due to truncanted DRs)
 		if len(crispr) == 2:
+			spacer_k_mers = self.filter_k_mers(crispr.spacers[0].sequence)
 			for i in range(0, 2):
-				for j in range(0, len(crispr.DR[i].sequence) - self.k_mer_size_filter):
-					for k in range(0, len(crispr.spacers[0].sequence) - self.k_mer_size_filter):
-						if crispr.DR[i].sequence[j : (j+self.k_mer_size_filter)] == crispr.spacers[0].sequence[k : (k + self.k_mer_size_filter)]:
-							match_counter += 1
+				match_counter += self.count_k_mer_matches(self.filter_k_mers(crispr.DR[i].sequence), spacer_k_mers)
 			
 			fractional_match = match_counter/2	
 		
 		# if multiple spacers are present
 		else:		
 			reference = crispr.DR[2].sequence	# we take 2nd repeat as reference (since first is often truncated)
-			for i in range(0, len(reference) - self.k_mer_size_filter):
-				small_seed = reference[i : (i + self.k_mer_size_filter)]		
-				for j in range(0, len(crispr.spacers)):
-					for k in range(0, len(crispr.spacers[j]) - self.k_mer_size_filter):
-						if small_seed == crispr.spacers[j].sequence[k : (k + self.k_mer_size_filter)]:
-							match_counter += 1
+			spacer_k_mers = collections.Counter()
+			for spacer in crispr.spacers:
+				spacer_k_mers.update(self.filter_k_mers(spacer.sequence))
+			match_counter += self.count_k_mer_matches(self.filter_k_mers(reference), spacer_k_mers)
 
 			fractional_match = match_counter/len(crispr.spacers)
 
@@ -942,6 +1848,19 @@ class FindCRISPRs:
 			self.CRISPRs.remove(crispr)
 			
 			
+	# counts k-mers of length k_mer_size_filter of sequence (last k-mer of sequence isn't taken)
+	def filter_k_mers(self, sequence):
+		return collections.Counter(sequence[i : (i + self.k_mer_size_filter)]\
+		 for i in range(0, len(sequence) - self.k_mer_size_filter))
+
+
+	# number of pairs of identical k-mers between two counted sets of k-mers
+	def count_k_mer_matches(self, k_mers1, k_mers2):
+		if len(k_mers1) > len(k_mers2):
+			k_mers1, k_mers2 = k_mers2, k_mers1
+		return sum(count * k_mers2[k_mer] for k_mer, count in k_mers1.items() if k_mer in k_mers2)
+
+
 	# once truncated DRs were added, checks if CRISPRs with them added still respect imposed conditions
 	# looks two last nucleotides of each repeat using 'lTrim' and 'rTrim' recursively while alterning 
 	# between them
@@ -965,7 +1884,7 @@ class FindCRISPRs:
 			# get most frequent nucl
 			max_freq = max(set(border_nucls), key = border_nucls.count)
 			if (len(border_nucls) - border_nucls.count(max_freq)) > border_limits:
-				crispr.DR_consensus = crispr.DR_consensus[(pos+1):]
+				crispr.trim_profile(pos + 1, 0)
 				for i in range(len(crispr.DR)):
 					rej_nucls = crispr.DR[i].sequence[:(pos+1)] # nucls deplaced to spacer
 					crispr.DR[i].sequence = crispr.DR[i].sequence[(pos+1):]
@@ -996,7 +1915,7 @@ class FindCRISPRs:
 			# get most frequent nucl
 			max_freq = max(set(border_nucls), key = border_nucls.count)
 			if (len(border_nucls) - border_nucls.count(max_freq)) > border_limits:
-				crispr.DR_consensus = crispr.DR_consensus[:(-1-pos)]
+				crispr.trim_profile(0, pos + 1)
 				for i in range(len(crispr.DR)):
 					rej_nucls = crispr.DR[i].sequence[(-1-pos):] # nucls deplaced to spacer
 					crispr.DR[i].sequence = crispr.DR[i].sequence[:(-1-pos)]
@@ -1019,7 +1938,9 @@ class FindCRISPRs:
 			self.rTrim(crispr, lTrim_continue, checker_depth, border_limits)
 			
 	
-		# function detecting tracrRNA
+	# function detecting tracrRNA
+	# fragments of all consensuses are found by a single scan of sequence, hits are then checked
+	# on a mask where CRISPRs and detected tracrRNAs are erased
 	def detect_tracrRNA(self, fasta):
 		# number of fragments to split DR to. NOTE: less fragments - lower 
 		# precision, but (way) faster. Should be 2 or 3.
@@ -1027,37 +1948,67 @@ class FindCRISPRs:
 		
 		
 		DR_consensuses = self.list_consensuses()	# list of DRs
-		copyseq = fasta.sequence	# copy of sequence, since masks will be applied to it
+		copyseq = bytearray(fasta.sequence[:].encode('latin-1', 'replace'))	# copy of sequence, since masks will be applied to it
 		
 		# apply masks to positions of CRISPRs
 		for CRISPR in self.CRISPRs:
-			CRISPR_len = CRISPR.end - CRISPR.begin + 1
-			copyseq = copyseq[0:(CRISPR.begin-2)]+'-'*CRISPR_len+copyseq[CRISPR.end-1:]
+			self.mask_sequence(copyseq, CRISPR.begin - 2, CRISPR.end - 1)
 	
+		segments = set()
 		for consensus in DR_consensuses:
 			len_segment = int(len(consensus)/DR_splits)
 			for i in range(0, DR_splits):
+				segments.add(consensus[i*len_segment:(i+1)*len_segment].encode('latin-1', 'replace'))
+		segments.discard(b'')
+		if not segments:
+			return
+
+		# positions of each fragment, lookahead finds every (even overlapping) occurrence
+		hits = self.find_segments(copyseq, segments)
+		for consensus in DR_consensuses:
+			len_segment = int(len(consensus)/DR_splits)
+			for i in range(0, DR_splits):
+				segment = consensus[i*len_segment:(i+1)*len_segment].encode('latin-1', 'replace')
 				found_at_pos = 0
-				while found_at_pos != -1:
-					search_obj = re.search(consensus[i*len_segment:(i+1)*len_segment],\
-					 copyseq[found_at_pos:])
-					if search_obj is not None:
-						found_at_pos += search_obj.span(0)[1]
-						# compute start and end of supposed match
-						match_start = found_at_pos - (len_segment*(i+1))
-						match_end = match_start + len(consensus)
-						if(self.compare_DRs(consensus,\
-						 copyseq[match_start:match_end], 2)):
-							print('tracrRNA detected at %s - %s for '\
-							 %(match_start + 1, match_end)+consensus+'.')
-							# mask found sequence
-							copyseq = copyseq[0:match_start-1]+'-'*(len(consensus)+1)+\
-							 copyseq[match_end:]
-							
-					else:
-						found_at_pos = -1		
+				for hit_pos in hits.get(segment, []):
+					# hits overlapping previous hit or masked since scan are skipped
+					if hit_pos < found_at_pos or not copyseq.startswith(segment, hit_pos):
+						continue
+					found_at_pos = hit_pos + len_segment
+					# compute start and end of supposed match
+					match_start = found_at_pos - (len_segment*(i+1))
+					match_end = match_start + len(consensus)
+					if match_start >= 0 and self.compare_DRs(consensus,\
+					 copyseq[match_start:match_end].decode('latin-1'), 2):
+						print('tracrRNA detected at %s - %s for '\
+						 %(match_start + 1 + fasta.offset, match_end + fasta.offset)+consensus+'.')
+						# mask found sequence
+						self.mask_sequence(copyseq, match_start - 1, match_end)
 			
 
+	# scans sequence once for all segments, returns dictionary of segment: ascending positions
+	def find_segments(self, sequence, segments):
+		hits = {}
+		segments = sorted(segments, key = len, reverse = True)
+		search_obj = re.compile(b'(?=(' + b'|'.join(re.escape(segment) for segment in segments) + b'))')
+		for hit in search_obj.finditer(sequence):
+			hit_pos = hit.start()
+			hits.setdefault(hit.group(1), []).append(hit_pos)
+			# shorter segments can start at same position
+			for segment in segments:
+				if len(segment) < len(hit.group(1)) and sequence.startswith(segment, hit_pos):
+					hits.setdefault(segment, []).append(hit_pos)
+		return hits
+
+
+	# masks positions from begin to end (excluded) of sequence copy used by 'detect_tracrRNA'
+	def mask_sequence(self, copyseq, begin, end):
+		begin = max(begin, 0)
+		end = min(end, len(copyseq))
+		if end > begin:
+			copyseq[begin:end] = b'-' * (end - begin)
+
+
 	# constructs a a list of unique DR consensuses
 	# index indicates the number of fasta file (order of treatment) 
 	def list_consensuses(self):
@@ -1103,7 +2054,7 @@ class FindCRISPRs:
 			self.output_path += "/"	
 			
 		self.output_path += RefSeq + "/"	
-		if not os.path.exists(self.output_path):	# create folder if not present already	
+		if self.store is None and not os.path.exists(self.output_path):	# create folder if not present already	
 			os.makedirs(self.output_path)
 		
 		CRISPR_number = 0
@@ -1123,6 +2074,16 @@ class FindCRISPRs:
 		self.generate_main_file(fasta, RefSeq, CRISPR_number, one_spacer_count)	
 		
 
+	# writes report file, or stores it in result store (under its path within output directory)
+	def write_report(self, file_path, content):
+		if self.store is not None:
+			self.store.write(os.path.relpath(file_path, self.output_root), content)
+		else:
+			new_file = open(file_path, 'w')
+			new_file.write(content)
+			new_file.close()
+
+
 	# generates an info file proper to each crispr:
 	#	-	crispr is a concerned crispr
 	#	-	RefSes is refseq number of corresponding sequence
@@ -1167,9 +2128,7 @@ class FindCRISPRs:
 		info_output += "#=========================================================================\n"
 		info_output += "########################################"
 		
-		new_file = open(file_path, 'w')
-		new_file.write(info_output)
-		new_file.close()		
+		self.write_report(file_path, info_output)		
 	
 	# generates a fasta of spacers for each CRISPR
 	#	-	crispr is corresponding crispr
@@ -1188,9 +2147,7 @@ class FindCRISPRs:
 			spacer_output += ">spacer%d\n"%CRISPR_number
 			spacer_output += spacer.sequence + "\n"
 
-		new_file = open(file_path, 'w')
-		new_file.write(spacer_output)
-		new_file.close()
+		self.write_report(file_path, spacer_output)
 		
 
 	# generates a crispr summary for given sequence
@@ -1219,77 +2176,770 @@ class FindCRISPRs:
 		main_output += "#\n"		
 		main_output += "#=======================================\n"
 
-		new_file = open(file_path, 'w')
-		new_file.write(main_output)
-		new_file.close()
+		self.write_report(file_path, main_output)
 		
 
 	# makes analysis of every sequence
-	def analyze (self):
-		fasta_n = 0
-		for fasta in self.fastas.fna_list:
+	# analyses one record and returns its CRISPRs, everything is computed from fasta only (state
+	# left by previous record is reset), so records can be analysed in any process
+	def analyze_record (self, fasta):
+		self.window_size = self.requested_window_size	# window may have been shortened for previous record
+		self.CRISPRs = []
+		if self.cache is not None:
+			self.cached_passes(fasta)
+			return self.build_CRISPRs(fasta)
+		self.first_pass(fasta)
+		self.clusters = []			# resets clusters
+		self.second_pass(fasta)
+		return self.build_CRISPRs(fasta)
+
+
+	# cache keys of first pass zones and second pass clusters of record, each one made of hash of 
+	# sequence and parameters stage depends on (window is the one used for record)
+	def stage_keys (self, fasta):
+		zones_parameters = (self.first_pass_engine, self.k_mer_size, self.window_size, self.allowed_mismatch, self.first_pass_limit, self.min_DR, self.max_DR)
+		if self.first_pass_engine == 'seed':
+			# repeats of seed engine are at most DR and longest spacer apart
+			zones_parameters += (self.max_spacer_DR_ratio,)
+		clusters_parameters = zones_parameters + (self.pattern.pattern, self.threshold, self.identity_limit, self.max_spacer_DR_ratio)
+		hashed = sequence_hash(fasta.sequence)
+		return self.cache.key('zones', hashed, zones_parameters), self.cache.key('clusters', hashed, clusters_parameters)
+
+
+	# first and second pass resumed from deepest stage of record found in cache, computed stages are cached
+	def cached_passes (self, fasta):
+		self.check_window_size(fasta)
+		zones_key, clusters_key = self.stage_keys(fasta)
+		clusters = self.cache.load(clusters_key)
+		zones = self.cache.load(zones_key)
+		if zones is None and clusters is None:
 			self.first_pass(fasta)
-			self.clusters = []			# resets clusters
+			self.cache.save(zones_key, [[int(zone.begin), int(zone.end)] for zone in self.repeat_list_first_pass])
+		else:
+			self.repeat_list_first_pass = [Repeat(fasta.sequence, begin, end, begin - 1) for begin, end in zones or []]
+
+		if clusters is None:
+			self.clusters = []
 			self.second_pass(fasta)
+			self.cache.save(clusters_key, clusters_to_json(self.clusters))
+		else:
+			self.clusters = clusters_from_json(clusters)
+
+
+	# analyses one (long) record, k-mer counts of chunks of sequence and clusters of zones are 
+	# computed by executor (pool of self.workers processes of analyze_parallel, or one of its own
+	# when not given). Zones are searched on counts of whole sequence, so results are the same 
+	# as those of analyze_record
+	def analyze_chunked_record (self, fasta, executor = None):
+		self.window_size = self.requested_window_size
+		self.CRISPRs = []
+		self.clusters = []
+		self.repeat_list_first_pass = []
+		self.check_window_size(fasta)
+
+		sequence_length = len(fasta.sequence)
+		if executor is None:
+			with concurrent.futures.ProcessPoolExecutor(self.workers, initializer = init_worker, initargs = (self.worker_copy(),)) as executor:
+				return self.analyze_chunked_record(fasta, executor)
+		parts = (self.range_part(fasta.sequence, start, min(start + self.chunk_size, sequence_length)) for start in range(0, sequence_length, self.chunk_size))
+		self.k_mer_counts = numpy.concatenate(list(executor.map(count_chunk_in_worker, parts)))
+		self.get_repeats(fasta, self.k_mer_counts)
+		# zones are sent in one group per worker, so record is pickled once per worker
+		zones = self.repeat_list_first_pass
+		group_size = max(-(-len(zones) // self.workers), 1)
+		groups = [(fasta, zones[i:i + group_size]) for i in range(0, len(zones), group_size)]
+		for clusters in executor.map(zone_clusters_in_worker, groups):
+			self.clusters.extend(clusters)
+
+		return self.build_CRISPRs(fasta)
+
+
+	# validates clusters of record as CRISPRs, filters them, searches for missed DRs and trims them
+	def build_CRISPRs (self, fasta):
+		for cluster in reversed(self.clusters):
+			self.validate(cluster, fasta)
 			
-			for cluster in reversed(self.clusters):
-				self.validate(cluster, fasta)
-				
-			self.CRISPRs = self.CRISPRs[::-1]	# invert result table
-			
-			for CRISPR in reversed(self.CRISPRs):
-				# if 1 then continue with next filter, otherwise source
-				check_ok = self.filter_low_complexity(CRISPR)	
-				if check_ok == 1:
-					self.filter_tandem(CRISPR)
-							
-			for i in range((len(self.CRISPRs) - 1), -1, -1):
-				previousCRISPR = None
-				thisCRISPR = self.CRISPRs[i]
-				nextCRISPR = None
-				if i > 0:
-					previousCRISPR = self.CRISPRs[i - 1]
-				
-				if i < (len(self.CRISPRs) - 1):
-					nextCRISPR = self.CRISPRs[i + 1]
+		self.CRISPRs = self.CRISPRs[::-1]	# invert result table
+		
+		for CRISPR in reversed(self.CRISPRs):
+			# if 1 then continue with next filter, otherwise source
+			check_ok = self.filter_low_complexity(CRISPR)	
+			if check_ok == 1:
+				self.filter_tandem(CRISPR)
 						
-				self.look_after_CRISPR(fasta, thisCRISPR, nextCRISPR)
-				self.look_before_CRISPR(fasta, thisCRISPR, previousCRISPR)
-				
-			for CRISPR in self.CRISPRs:
-				self.check_truncated (CRISPR, fasta, -1)
-				self.check_truncated (CRISPR, fasta, 1)
-				
-			# deleting entries, so reversing passage by list
-			for CRISPR in self.CRISPRs:
-				self.border_trimmer(CRISPR)	
+		for i in range((len(self.CRISPRs) - 1), -1, -1):
+			previousCRISPR = None
+			thisCRISPR = self.CRISPRs[i]
+			nextCRISPR = None
+			if i > 0:
+				previousCRISPR = self.CRISPRs[i - 1]
+			
+			if i < (len(self.CRISPRs) - 1):
+				nextCRISPR = self.CRISPRs[i + 1]
 					
+			self.look_after_CRISPR(fasta, thisCRISPR, nextCRISPR)
+			self.look_before_CRISPR(fasta, thisCRISPR, previousCRISPR)
+			
+		for CRISPR in self.CRISPRs:
+			self.check_truncated (CRISPR, fasta, -1)
+			self.check_truncated (CRISPR, fasta, 1)
+			
+		# deleting entries, so reversing passage by list
+		for CRISPR in self.CRISPRs:
+			self.border_trimmer(CRISPR)	
+
+		return self.CRISPRs
+
+
+	# stores CRISPRs of analysed record, searches tracrRNA and outputs files (always done in 
+	# order of records)
+	def finish_record (self, fasta, CRISPRs):
+		# kept results don't hold sequence of record
+		for CRISPR in CRISPRs:
+			CRISPR.copy_sequences()
+		self.CRISPRs = CRISPRs
+		self.headers_all.append(fasta.header)
+		self.CRISPRs_all.append(list(CRISPRs))
+				
+		if self.search_tracrRNA:		
+			self.detect_tracrRNA(fasta)
+
+		# positions within region are converted to positions within record
+		if fasta.offset:
 			for CRISPR in self.CRISPRs:
-				self.CRISPRs_all[fasta_n].append(CRISPR)
-					
-			if self.search_tracrRNA:		
-				self.detect_tracrRNA(fasta)
+				CRISPR.shift(fasta.offset)
 
-			# outputting files
+		# outputting files
+		if 'legacy' in self.output_formats:
 			self.output(fasta)
-			
-			for CRISPR in reversed(self.CRISPRs):
-				self.CRISPRs.remove(CRISPR)
-			
-			fasta_n += 1
+		for writer in self.writers:
+			writer.write_record(fasta, self.CRISPRs)
+		if self.catalog is not None:
+			self.catalog.add_record(os.path.abspath(self.fastas.file_path), fasta, self.CRISPRs)
+		
+		self.CRISPRs = []
+
+
+	# opens one writer per machine readable output format (and result store of report files)
+	def open_writers (self):
+		formats = [output_format for output_format in self.output_formats if output_format in RESULT_WRITERS]
+		packed = self.result_store and 'legacy' in self.output_formats
+		if (formats or packed) and not os.path.exists(self.output_root):
+			os.makedirs(self.output_root)
+		self.writers = [RESULT_WRITERS[output_format](self.output_root) for output_format in formats]
+		if packed:
+			self.store = ResultStore(os.path.join(self.output_root, RESULT_STORE_NAME))
+		if self.catalog_path is not None:
+			self.catalog = Catalog(self.catalog_path)
+
+
+	def close_writers (self):
+		for writer in self.writers:
+			writer.close()
+		self.writers = []
+		if self.store is not None:
+			self.store.close()
+			self.store = None
+		if self.catalog is not None:
+			self.catalog.close()
+			self.catalog = None
+
+
+	# copy of finder sent to worker processes (without reader of sequences nor results)
+	def worker_copy (self):
+		finder = copy.copy(self)
+		finder.fastas = None
+		finder.writers = []
+		finder.store = None
+		finder.catalog = None
+		finder.CRISPRs_all = []
+		finder.headers_all = []
+		return finder
+
+
+	# records are analysed by pool of self.workers processes, at most 2 records per worker are 
+	# waiting to be finished. Results and messages of records are handled in order of records
+	# records longer than self.chunk_size are analysed one by one, split in chunks
+	# analyses records of fastas (all records by default) in worker processes, each record is
+	# then given to finish (finish_record by default) in order of records
+	def analyze_parallel (self, fastas = None, finish = None):
+		fastas = self.fastas if fastas is None else fastas
+		finish = self.finish_record if finish is None else finish
+		with concurrent.futures.ProcessPoolExecutor(self.workers, initializer = init_worker, initargs = (self.worker_copy(),)) as executor:
+			pending = collections.deque()
+			for fasta in fastas:
+				if self.chunk_size and len(fasta.sequence) > self.chunk_size:
+					while pending:
+						self.collect_record(finish, *pending.popleft())
+					finish(fasta, self.analyze_chunked_record(fasta, executor))
+					continue
+
+				pending.append((fasta, executor.submit(analyze_in_worker, fasta)))
+				if len(pending) >= 2*self.workers:
+					self.collect_record(finish, *pending.popleft())
+
+			while pending:
+				self.collect_record(finish, *pending.popleft())
+
+
+	def collect_record (self, finish, fasta, future):
+		CRISPRs, messages = future.result()
+		print(messages, end = '')
+		finish(fasta, CRISPRs)
+
+
+	# yields records of fasta file read (and encoded) by a reader thread, which stays at most 
+	# PIPELINE_QUEUE_SIZE records ahead. Errors of reader are raised here
+	def pipelined_records (self):
+		records = queue.Queue(PIPELINE_QUEUE_SIZE)
+
+		def read ():
+			try:
+				for fasta in self.fastas:
+					records.put((fasta, None))
+			except BaseException as error:
+				records.put((None, error))
+			else:
+				records.put((None, None))
+
+		threading.Thread(target = read, daemon = True).start()
+		while True:
+			fasta, error = records.get()
+			if error is not None:
+				raise error
+			if fasta is None:
+				return
+			yield fasta
+
+
+	# analyses records while next ones are read by a reader thread (see pipelined_records) and 
+	# previous ones are finished (tracrRNA, output files) by a writer thread. Writer thread uses 
+	# its own copy of finder (sharing lists of results) which opens output writers
+	def analyze_pipelined (self):
+		writer = copy.copy(self)
+		results = queue.Queue(PIPELINE_QUEUE_SIZE)
+		errors = []
+
+		def write ():
+			try:
+				writer.open_writers()
+				while True:
+					result = results.get()
+					if result is None:
+						break
+					if not errors:		# after an error, results are only consumed
+						writer.finish_record(*result)
+			except BaseException as error:
+				errors.append(error)
+				while results.get() is not None:
+					pass
+			finally:
+				try:
+					writer.close_writers()
+				except BaseException as error:
+					errors.append(error)
+
+		# analysis stops at first record finished after an error of writer thread
+		def put (fasta, CRISPRs):
+			results.put((fasta, CRISPRs))
+			if errors:
+				raise errors[0]
+
+		writer_thread = threading.Thread(target = write)
+		writer_thread.start()
+		try:
+			if self.workers > 1:
+				self.analyze_parallel(self.pipelined_records(), put)
+			else:
+				for fasta in self.pipelined_records():
+					put(fasta, self.analyze_record(fasta))
+		finally:
+			results.put(None)
+			writer_thread.join()
+		if errors:
+			raise errors[0]
+
+
+	# copy of finder using parameters (dictionary of SWEEP_PARAMETERS names - values) instead of its own
+	def parameter_set_finder (self, parameters):
+		finder = self.worker_copy()
+		for name, value in parameters.items():
+			if name not in SWEEP_PARAMETERS:
+				print("Error: parameter '%s' can't be swept, choose among: %s." % (name, ', '.join(sorted(SWEEP_PARAMETERS))))
+				sys.exit()
+			if name == 'pattern':
+				finder.pattern = Pattern(value)
+				finder.k_mer_size = len(finder.pattern)
+				if finder.k_mer_size < 5:
+					print("Error: Pattern has too low number of accepted symbols '#'; please enter the pattern with at least 5.")
+					sys.exit()
+			else:
+				setattr(finder, SWEEP_PARAMETERS[name], value)
+		return finder
+
+
+	# analyses every record with each of parameter_sets (list of dictionaries, see parameter_set_finder).
+	# First pass is shared by parameter sets: k-mer counts are computed once for each k-mer size and
+	# window size (k-mer size, min_DR, max_DR and max_spacer_DR_ratio with 'seed' engine), zones once
+	# for each parameters they depend on (also allowed_mismatch, first_pass_limit, min_DR and max_DR),
+	# only second pass and filters are done for each set. Returns table of results, one dictionary 
+	# per CRISPR with number of parameter set (from 1) and its parameters
+	def sweep (self, parameter_sets):
+		finders = [self.parameter_set_finder(parameters) for parameters in parameter_sets]
+		table = []
+		for fasta in self.fastas:
+			counts = {}
+			zones = {}
+			for set_number, finder in enumerate(finders, 1):
+				finder.window_size = finder.requested_window_size
+				finder.check_window_size(fasta)
+				if finder.first_pass_engine == 'seed':
+					counts_key = (finder.k_mer_size, finder.min_DR, finder.max_DR, finder.max_spacer_DR_ratio)
+					if counts_key not in counts:
+						finder.seed_sequence_counts(fasta)
+						counts[counts_key] = finder.k_mer_counts
+				else:
+					counts_key = (finder.k_mer_size, finder.window_size)
+					if counts_key not in counts:
+						counts[counts_key] = finder.range_counts(fasta.sequence, 0, len(fasta.sequence))
+				zones_key = counts_key + (finder.allowed_mismatch, finder.first_pass_limit, finder.min_DR, finder.max_DR)
+				if zones_key not in zones:
+					finder.repeat_list_first_pass = []
+					finder.get_repeats(fasta, counts[counts_key])
+					zones[zones_key] = finder.repeat_list_first_pass
+				finder.repeat_list_first_pass = zones[zones_key]
+
+				finder.CRISPRs = []
+				finder.clusters = []
+				finder.second_pass(fasta)
+				CRISPRs = finder.build_CRISPRs(fasta)
+				for CRISPR_number, crispr in enumerate(CRISPRs, 1):
+					if fasta.offset:
+						crispr.shift(fasta.offset)
+					row = {'set': set_number}
+					row.update(parameter_sets[set_number - 1])
+					row.update({'sequence': record_id(fasta), 'crispr': CRISPR_number, 'begin': crispr.begin, 'end': crispr.end,\
+					 'DR_consensus': crispr.DR_consensus, 'number_of_spacers': len(crispr.spacers), 'hypothetic': crispr.hypothetic})
+					table.append(row)
+		return table
+
+
+	# writes table of sweep results as tab separated file (one column per swept parameter)
+	def write_sweep_table (self, table, parameter_sets, file_path):
+		names = sorted(set(name for parameters in parameter_sets for name in parameters))
+		columns = ['set'] + names + ['sequence', 'crispr', 'begin', 'end', 'DR_consensus', 'number_of_spacers', 'hypothetic']
+		with open(file_path, 'w') as table_file:
+			table_file.write('\t'.join(columns) + '\n')
+			for row in table:
+				table_file.write('\t'.join(str(row.get(column, '')) for column in columns) + '\n')
+
+
+	# minimum length of sequence containing CRISPR : two DRs and one spacer, all of minimum length
+	def min_array_length (self):
+		return 2 * self.min_DR + self.min_spacer_DR_ratio * self.min_DR
+
+
+	# analyses many short records (contigs of metagenome assembly): records shorter than 
+	# min_array_length are skipped, k-mers of others are counted by batches (see batch_counts) and
+	# only records with zones go through second pass. Only records with CRISPRs are finished
+	def analyze_metagenome (self):
+		min_length = self.min_array_length()
+		batch = []
+		batch_length = 0
+		record_count = 0
+		skipped_count = 0
+		for fasta in self.fastas:
+			record_count += 1
+			if len(fasta.sequence) < min_length:
+				skipped_count += 1
+				continue
+			batch.append(fasta)
+			batch_length += len(fasta.sequence) + 1
+			if batch_length >= METAGENOME_BATCH_SIZE:
+				self.analyze_batch(batch)
+				batch = []
+				batch_length = 0
+		if batch:
+			self.analyze_batch(batch)
+		print("Metagenome: %d sequences, %d shorter than %d bp skipped, %d with CRISPRs" % (record_count, skipped_count,\
+		 math.ceil(min_length), len(self.CRISPRs_all)))
+
+
+	# k-mer counts of records of batch, concatenated and separated by sentinel (so k-mers overlapping 
+	# next record are unique). Window of each position is bounded by its record and shortened for 
+	# records shorter than window, so counts are the same as those of records analysed one by one.
+	# Returns counts, starts of records within counts and their lengths
+	def batch_counts (self, batch):
+		lengths = numpy.array([len(fasta.sequence) for fasta in batch], dtype=numpy.int64)
+		starts = numpy.cumsum(lengths + 1) - (lengths + 1)
+		if isinstance(batch[0].sequence, EncodedSeq):
+			sentinel = numpy.array([SENTINEL_CODE], dtype=numpy.uint8)
+			codes = numpy.concatenate([codes for fasta in batch for codes in (fasta.sequence.codes, sentinel)])
+		else:
+			codes = self.sequence_codes(SENTINEL.join(fasta.sequence for fasta in batch) + SENTINEL)
+
+		record_lengths = numpy.repeat(lengths, lengths + 1)
+		record_starts = numpy.repeat(starts, lengths + 1)
+		windows = numpy.minimum(record_lengths, self.requested_window_size)
+		lo, hi = self.window_bounds(numpy.arange(len(codes)) - record_starts, record_lengths, windows)
+		return self.bounded_counts(codes, lo + record_starts, hi + record_starts), starts, lengths
+
+
+	def analyze_batch (self, batch):
+		counts, starts, lengths = self.batch_counts(batch)
+		# only records with repeated k-mers can have zones
+		candidates = numpy.unique(numpy.searchsorted(starts, numpy.flatnonzero(counts > 1), side='right') - 1)
+		for index in candidates.tolist():
+			fasta = batch[index]
+			self.window_size = min(self.requested_window_size, len(fasta.sequence))
+			self.repeat_list_first_pass = []
+			self.get_array_repeats(fasta, counts[starts[index] : starts[index] + lengths[index]])
+			if not self.repeat_list_first_pass:
+				continue
+			self.CRISPRs = []
+			self.clusters = []
+			self.second_pass(fasta)
+			CRISPRs = self.build_CRISPRs(fasta)
+			if CRISPRs:
+				self.finish_record(fasta, CRISPRs)
+
+
+	def analyze (self):
+		if self.metagenome:
+			self.open_writers()
+			try:
+				self.analyze_metagenome()
+			finally:
+				self.close_writers()
+		elif self.pipeline:
+			self.analyze_pipelined()
+		else:
+			self.open_writers()
+			try:
+				if self.workers > 1:
+					self.analyze_parallel()
+				else:
+					for fasta in self.fastas:
+						self.finish_record(fasta, self.analyze_record(fasta))
+			finally:
+				self.close_writers()
 			
 		for i in range(len(self.CRISPRs_all)):
 			print('-------------')
-			print(self.fastas.fna_list[i].header)
+			print(self.headers_all[i])
 			print('-------------')
 			for CRISPR in self.CRISPRs_all[i]:
 				print(CRISPR)
 			
 			
 
-# uses classes FindRepeats to analyse every sequence of FastaList
+# functions run by worker processes of FindCRISPRs.analyze_parallel, each worker process keeps 
+# its own copy of finder (so state of records is isolated), messages printed during analysis 
+# are returned with CRISPRs. Chunks of long records (FindCRISPRs.analyze_chunked_record) are 
+# analysed by the same workers, the record is passed with their tasks
+worker_finder = None
+
+def init_worker(finder):
+	global worker_finder
+	worker_finder = finder
+
+
+def analyze_in_worker(fasta):
+	messages = io.StringIO()
+	with contextlib.redirect_stdout(messages):
+		CRISPRs = worker_finder.analyze_record(fasta)
+	return CRISPRs, messages.getvalue()
+
+
+def count_chunk_in_worker(part):
+	return worker_finder.part_counts(*part)
+
+
+def zone_clusters_in_worker(group):
+	fasta, zones = group
+	clusters = []
+	for repeat in zones:
+		clusters.extend(worker_finder.zone_clusters(repeat, fasta))
+	return clusters
+
+
+# uses classes FindRepeats to analyse every sequence of FastaReader
 # FindRepeats results are then selected by their proximity and other properties before obtaining CRISPRs
 
+##################
+# Output Writers #
+##################
+
+# writers of machine readable results, each one streams records of every analysed sequence into
+# a single (buffered) file of output directory:
+#	-	file_name is name of written file
+#	-	write_record writes CRISPRs of one sequence, numbered from 1 as in report files
+
+class ResultWriter:
+	file_name = None
+
+	def __init__ (self, output_dir):
+		self.path = os.path.join(output_dir, self.file_name)
+		self.handle = open(self.path, 'w')
+		self.write_header()
+
+	def write_header (self):
+		pass
+
+	def write_record (self, fasta, CRISPRs):
+		sequence_id = record_id(fasta)
+		for CRISPR_number, crispr in enumerate(CRISPRs, 1):
+			self.write_CRISPR(sequence_id, CRISPR_number, crispr)
+
+	def close (self):
+		self.handle.close()
+
+
+# list of parameter sets (dictionaries) made of every combination of values of grid (dictionary
+# of parameter - list of values)
+def parameter_grid(grid):
+	names = sorted(grid)
+	return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+# identifier of sequence : first word of its header
+def record_id(fasta):
+	words = fasta.header.lstrip('>').split()
+	return words[0] if words else 'unknown'
+
+
+# one JSON object per line for each CRISPR, with its DRs and spacers
+class JsonlWriter(ResultWriter):
+	file_name = 'CRISPRs.jsonl'
+
+	def write_CRISPR (self, sequence_id, CRISPR_number, crispr):
+		record = {'sequence': sequence_id, 'crispr': CRISPR_number,
+		 'begin': crispr.DR[0].begin, 'end': crispr.DR[-1].end,
+		 'hypothetic': crispr.hypothetic == "yes", 'DR_consensus': crispr.DR_consensus,
+		 'DRs': [{'begin': DR.begin, 'end': DR.end, 'sequence': DR.sequence} for DR in crispr.DR],
+		 'spacers': [{'begin': spacer.begin, 'end': spacer.end, 'sequence': spacer.sequence} for spacer in crispr.spacers]}
+		self.handle.write(json.dumps(record) + "\n")
+
+
+# one tab separated line for each CRISPR, spacers are separated by ','
+class TsvWriter(ResultWriter):
+	file_name = 'CRISPRs.tsv'
+
+	def write_header (self):
+		self.handle.write("sequence\tcrispr\tbegin\tend\thypothetic\tDR_consensus\tDR_length\tnumber_of_spacers\tspacers\n")
+
+	def write_CRISPR (self, sequence_id, CRISPR_number, crispr):
+		self.handle.write("%s\t%d\t%d\t%d\t%s\t%s\t%d\t%d\t%s\n" % (sequence_id, CRISPR_number,\
+		 crispr.DR[0].begin, crispr.DR[-1].end, crispr.hypothetic, crispr.DR_consensus, len(crispr.DR_consensus),\
+		 len(crispr.spacers), ','.join(spacer.sequence for spacer in crispr.spacers)))
+
+
+# GFF3 features: CRISPR (whole array), CRISPRdr and CRISPRspacer (children of CRISPR)
+class Gff3Writer(ResultWriter):
+	file_name = 'CRISPRs.gff3'
+
+	def write_header (self):
+		self.handle.write("##gff-version 3\n")
+
+	def write_CRISPR (self, sequence_id, CRISPR_number, crispr):
+		seqid = urllib.parse.quote(sequence_id, safe=".:^*$@!+_?-|")
+		CRISPR_id = urllib.parse.quote("%s_CRISPR_%d" % (sequence_id, CRISPR_number), safe=".:^*$@!+_?-|")
+		self.write_feature(seqid, 'CRISPR', crispr.DR[0].begin, crispr.DR[-1].end, 'ID=%s;DR=%s;DR_length=%d;Number_of_spacers=%d;Hypothetic=%s'\
+		 % (CRISPR_id, crispr.DR_consensus, len(crispr.DR_consensus), len(crispr.spacers), crispr.hypothetic))
+		for DR in crispr.DR:
+			self.write_feature(seqid, 'CRISPRdr', DR.begin, DR.end, 'Parent=%s' % CRISPR_id)
+		for spacer in crispr.spacers:
+			self.write_feature(seqid, 'CRISPRspacer', spacer.begin, spacer.end, 'Parent=%s;Sequence=%s' % (CRISPR_id, spacer.sequence))
+
+	def write_feature (self, seqid, feature_type, begin, end, attributes):
+		self.handle.write("%s\tCRISPRFinder\t%s\t%d\t%d\t.\t.\t.\t%s\n" % (seqid, feature_type, begin, end, attributes))
+
+
+RESULT_WRITERS = {'jsonl': JsonlWriter, 'tsv': TsvWriter, 'gff3': Gff3Writer}
+
+
+# single SQLite file containing report files of a job (instead of a directory per sequence), 
+# files are stored with their path within output directory and can be read one by one
+RESULT_STORE_NAME = 'results.sqlite'
+
+class ResultStore:
+	def __init__ (self, path):
+		self.connection = sqlite3.connect(path)
+		self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, content TEXT)")
+
+	def write (self, path, content):
+		self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (path, content))
+
+	# returns content of file, None if there isn't such file
+	def read (self, path):
+		row = self.connection.execute("SELECT content FROM files WHERE path = ?", (path,)).fetchone()
+		return row[0] if row is not None else None
+
+	# returns sorted paths of stored files
+	def list (self):
+		return [row[0] for row in self.connection.execute("SELECT path FROM files ORDER BY path")]
+
+	def close (self):
+		self.connection.commit()
+		self.connection.close()
+
+
+# persistent catalog of DR consensuses and spacers of CRISPRs found by several analyses (SQLite 
+# file), with the file and record where they were found. Sequences are looked up exactly or 
+# with up to CATALOG_MISMATCHES mismatches (Hamming distance, as compare_DRs): each sequence is 
+# indexed by CATALOG_MISMATCHES + 1 parts, a sequence with fewer mismatches shares at least one 
+# part exactly with query, so only sequences sharing a part are compared
+CATALOG_MISMATCHES = 2
+
+class Catalog:
+	def __init__ (self, path):
+		self.connection = sqlite3.connect(path, timeout = 60)
+		self.connection.executescript("""
+			CREATE TABLE IF NOT EXISTS crisprs (id INTEGER PRIMARY KEY, source TEXT, record TEXT, header TEXT,
+			 number INTEGER, begin INTEGER, end INTEGER, DR_consensus TEXT);
+			CREATE TABLE IF NOT EXISTS elements (id INTEGER PRIMARY KEY, crispr_id INTEGER, kind TEXT,
+			 begin INTEGER, end INTEGER, sequence TEXT);
+			CREATE TABLE IF NOT EXISTS parts (length INTEGER, part INTEGER, segment TEXT, element_id INTEGER);
+			CREATE INDEX IF NOT EXISTS elements_sequence ON elements (sequence);
+			CREATE INDEX IF NOT EXISTS parts_segment ON parts (length, part, segment);
+		""")
+
+	# splits sequence into CATALOG_MISMATCHES + 1 parts
+	def parts (self, sequence):
+		bounds = [len(sequence) * i // (CATALOG_MISMATCHES + 1) for i in range(CATALOG_MISMATCHES + 2)]
+		return [sequence[bounds[i]:bounds[i + 1]] for i in range(CATALOG_MISMATCHES + 1)]
+
+	# adds DR consensus and spacers of CRISPRs of one record (of fasta file source)
+	def add_record (self, source, fasta, CRISPRs):
+		for CRISPR_number, crispr in enumerate(CRISPRs, 1):
+			crispr_id = self.connection.execute("INSERT INTO crisprs (source, record, header, number, begin, end, DR_consensus)"\
+			 " VALUES (?, ?, ?, ?, ?, ?, ?)", (source, record_id(fasta), fasta.header, CRISPR_number, crispr.begin, crispr.end,\
+			 crispr.DR_consensus.upper())).lastrowid
+			elements = [('DR', crispr.begin, crispr.end, crispr.DR_consensus)]
+			elements += [('spacer', spacer.begin, spacer.end, spacer.sequence) for spacer in crispr.spacers]
+			for kind, begin, end, sequence in elements:
+				sequence = sequence.upper()
+				element_id = self.connection.execute("INSERT INTO elements (crispr_id, kind, begin, end, sequence) VALUES (?, ?, ?, ?, ?)",\
+				 (crispr_id, kind, begin, end, sequence)).lastrowid
+				self.connection.executemany("INSERT INTO parts VALUES (?, ?, ?, ?)",\
+				 [(len(sequence), part, segment, element_id) for part, segment in enumerate(self.parts(sequence))])
+		self.connection.commit()
+
+	# returns DRs and spacers with at most mismatches differences with sequence (same length),
+	# closest first, as dictionaries (kind, sequence, mismatches, source, record, crispr number, begin, end)
+	def query (self, sequence, mismatches = 0):
+		if mismatches > CATALOG_MISMATCHES:
+			print("Warning!! Catalog is indexed for at most %d mismatches, setting value to %d" % (CATALOG_MISMATCHES, CATALOG_MISMATCHES))
+			mismatches = CATALOG_MISMATCHES
+		sequence = sequence.upper()
+		columns = "elements.kind, elements.sequence, crisprs.source, crisprs.record, crisprs.number, elements.begin, elements.end"
+		if mismatches == 0:
+			rows = self.connection.execute("SELECT " + columns + " FROM elements JOIN crisprs ON crisprs.id = elements.crispr_id"\
+			 " WHERE elements.sequence = ?", (sequence,)).fetchall()
+		else:
+			parts = self.parts(sequence)
+			rows = self.connection.execute("SELECT DISTINCT elements.id, " + columns + " FROM parts"\
+			 " JOIN elements ON elements.id = parts.element_id JOIN crisprs ON crisprs.id = elements.crispr_id"\
+			 " WHERE " + " OR ".join(["(parts.length = ? AND parts.part = ? AND parts.segment = ?)"] * len(parts)),\
+			 [value for part, segment in enumerate(parts) for value in (len(sequence), part, segment)]).fetchall()
+			rows = [row[1:] for row in rows]
+
+		hits = []
+		for kind, found, source, record, number, begin, end in rows:
+			differences = sum(1 for nucl1, nucl2 in zip(sequence, found) if nucl1 != nucl2)
+			if len(found) == len(sequence) and differences <= mismatches:
+				hits.append({'kind': kind, 'sequence': found, 'mismatches': differences, 'source': source,\
+				 'record': record, 'crispr': number, 'begin': begin, 'end': end})
+		hits.sort(key = lambda hit: (hit['mismatches'], hit['source'], hit['record'], hit['crispr'], hit['begin']))
+		return hits
+
+	def close (self):
+		self.connection.commit()
+		self.connection.close()
+
+
+# persistent cache of intermediate stages of analysis (first pass zones and second pass clusters),
+# one JSON file per entry in directory. Entries are keyed by hash of sequence content and of 
+# parameters the stage depends on (see FindCRISPRs.stage_keys). Reading an entry marks it as 
+# recently used (modification time), least recently used entries are removed once files take 
+# more than max_size bytes. Files are written under temporary names and renamed, so several 
+# processes can share cache
+class StageCache:
+	def __init__ (self, directory, max_size):
+		self.directory = directory
+		self.max_size = max_size
+		os.makedirs(self.directory, exist_ok = True)
+
+	# key of entry : hash of sequence (hash of its content) and of parameters
+	def key (self, stage, sequence_hash, parameters):
+		return stage + '_' + hashlib.sha1(repr((sequence_hash,) + tuple(parameters)).encode()).hexdigest()
+
+	def path (self, key):
+		return os.path.join(self.directory, key + '.json')
+
+	# returns content of entry, None if there isn't such entry (or it can't be read)
+	def load (self, key):
+		try:
+			with open(self.path(key)) as entry_file:
+				content = json.load(entry_file)
+			os.utime(self.path(key))
+		except (OSError, ValueError):
+			return None
+		return content
+
+	def save (self, key, content):
+		temporary_path = self.path(key) + '.%d.tmp' % os.getpid()
+		with open(temporary_path, 'w') as entry_file:
+			json.dump(content, entry_file)
+		os.replace(temporary_path, self.path(key))
+		self.evict()
+
+	# removes least recently used entries until cache fits in max_size
+	def evict (self):
+		entries = []
+		for file_name in os.listdir(self.directory):
+			if file_name.endswith('.json'):
+				try:
+					status = os.stat(os.path.join(self.directory, file_name))
+				except OSError:
+					continue
+				entries.append((status.st_mtime, file_name, status.st_size))
+		total_size = sum(size for modified, file_name, size in entries)
+		for modified, file_name, size in sorted(entries):
+			if total_size <= self.max_size:
+				break
+			try:
+				os.remove(os.path.join(self.directory, file_name))
+			except OSError:
+				pass
+			total_size -= size
+
+
+# hash of sequence content (EncodedSeq and strings are hashed differently, as case is normalized in EncodedSeq)
+def sequence_hash(sequence):
+	if isinstance(sequence, EncodedSeq):
+		return 'encoded:' + hashlib.sha1(sequence.codes.tobytes()).hexdigest()
+	return hashlib.sha1(sequence.encode()).hexdigest()
+
+
+# clusters as JSON content : for each cluster, its id, most_repeated and (sequence, begin, end) of repeats
+def clusters_to_json(clusters):
+	return [{'cluster_id': cluster.cluster_id,\
+	 'most_repeated': [value if value is None or isinstance(value, str) else int(value) for value in cluster.most_repeated],\
+	 'repeats': [[repeat.sequence, int(repeat.begin), int(repeat.end)] for repeat in cluster.repeats]} for cluster in clusters]
+
+
+def clusters_from_json(content):
+	clusters = []
+	for item in content:
+		cluster = Cluster(item['cluster_id'])
+		cluster.most_repeated = item['most_repeated']
+		for sequence, begin, end in item['repeats']:
+			cluster.add_repeat(Repeat(sequence, begin, end))
+		clusters.append(cluster)
+	return clusters
+
+
 ##################
 # Object Classes #
 ##################
@@ -1298,46 +2948,63 @@ class FindCRISPRs:
 #	-	sequence
 # 	-	starting position
 #	-	ending position	
+# sequence is not copied when start is given: then repeat is only a view of shared sequence
+# (source) starting at start, and its sequence is sliced when needed. Coordinates can be moved 
+# (see CRISPR.shift) without changing sequence. Setting sequence replaces source by a copy.
 class Repeat:
-	def __init__ (self, sequence, begin, end):
-		self.sequence = sequence
+	__slots__ = ('source', 'start', 'begin', 'end')
+
+	def __init__ (self, sequence, begin, end, start = None):
 		self.begin = begin
 		self.end = end
+		if start is None:
+			self.source = sequence
+			self.start = 0
+		elif start < 0 or start + end - begin + 1 > len(sequence):
+			# not entirely inside of sequence, copied as sliced
+			self.source = sequence[start : (start + end - begin + 1)]
+			self.start = 0
+		else:
+			self.source = sequence
+			self.start = start
+
+	@property
+	def sequence(self):
+		return self.source[self.start : (self.start + len(self))]
+
+	@sequence.setter
+	def sequence(self, sequence):
+		self.source = sequence
+		self.start = 0
 		
 	def __str__(self):
 		return "Sequence: " + self.sequence + " Begin: %d End: %d"%(self.begin, self.end)
 
 	def __len__(self):
-		return len(self.sequence)
+		return max(0, min(self.end - self.begin + 1, len(self.source) - self.start))
+
+	# views are pickled with their own sequence, not with whole shared sequence
+	def __reduce__(self):
+		return (type(self), (self.sequence, self.begin, self.end))
 
 
 # contains spacer, functionally identical to repeat :
 #	-	sequence
 # 	-	starting position
 #	-	ending position	
-class Spacer:
-	def __init__ (self, sequence, begin, end):
-		self.sequence = sequence
-		self.begin = begin
-		self.end = end
-		
-	def __str__(self):
-		return "Sequence: " + self.sequence + " Begin: %d End: %d"%(self.begin, self.end)
-
-	def __len__(self):
-		return len(self.sequence)
+class Spacer(Repeat):
+	__slots__ = ()
 
 
 # a class containing a repeats which are in same cluster:
 # 	-	list of repeats in same cluster
-#	-	cluster_id is each cluster unique identifier and counts number of created instances of class Cluster
+#	-	cluster_id is number of cluster within its zone of first pass
 #	-	most_repeated stocks pattern sequence with maximum number of occurences (possible seed), first repeat where it can be found, and its position within repeat 
 class Cluster:
-	counter = 1
+	__slots__ = ('cluster_id', 'repeats', 'most_repeated')
 
-	def __init__ (self):
-		self.cluster_id = Cluster.counter
-		Cluster.counter += 1
+	def __init__ (self, cluster_id = None):
+		self.cluster_id = cluster_id
 		self.repeats = []
 		self.most_repeated = [None]*3
 
@@ -1355,20 +3022,20 @@ class Cluster:
 		return len(self.repeats)
 
 	def __str__ (self):
-		string = "Start of Cluster %d \n"%self.cluster_id
+		string = "Start of Cluster %s \n"%self.cluster_id
 		for repeat in self.repeats:
 			string = string + str(repeat) + "\n"
-		string = string + "End of Cluster %d \n"%self.cluster_id 
+		string = string + "End of Cluster %s \n"%self.cluster_id 
 		return string
 
-	def __del__ (self):
-		del self.cluster_id
-
 
 # a class containing integrity of information about CRISPR
 # 	-	self.DR contains list of DR, which are instances of Repeat class
 #	-	self.spacers contains list of spacers, which are instances of Spacer class
+#	-	self.profile contains counts of nucleotides (A, C, G, T, other) at each position of DR,
+#		it is updated when DR is inserted and DR consensus is read from it
 class CRISPR:
+	__slots__ = ('begin', 'end', 'sequence_name', 'DR', 'DR_consensus', 'spacers', 'hypothetic', 'profile')
 	#CRISPR_number = 1
 
 	def __init__ (self, repeats, fasta):
@@ -1385,7 +3052,7 @@ class CRISPR:
 		for i in range(0, len(self.DR) - 1):
 			spacer_begin = self.DR[i].end + 1
 			spacer_end = self.DR[i + 1].begin - 1
-			new_spacer = Spacer(fasta.sequence[(spacer_begin - 1):spacer_end], spacer_begin, spacer_end)
+			new_spacer = Spacer(fasta.sequence, spacer_begin, spacer_end, spacer_begin - 1)
 			self.spacers.append(new_spacer)
 		
 		# calculate DR consensus			
@@ -1400,24 +3067,30 @@ class CRISPR:
 		else:
 			self.hypothetic = "no"
 			
-	# determines consensus		
+	# determines consensus from scratch: profile counts A, C, G, T (whatever the case) and other
+	# characters (N_CODE) at each position of DR, consensus is the most frequent nucleotide
 	def calculate_consensus(self):
-		self.DR_consensus = ''
-		for i in range(0, len(self.DR[0])):
-			alphabet = ['A', 'C', 'G', 'T', 'a', 'c', 'g', 't']	# alpabet used in DNA
-			nucl_counts = [0, 0, 0, 0] 				# counts of A, C, G, T per position
-			for j in range(0, len(self.DR)):
-				k = 0
-				letter_found = 0
-				while letter_found == 0 and k<4:
-					# if character equals capital or small letter of DNA alphabet	
-					if(self.DR[j].sequence[i] == alphabet[k] or self.DR[j].sequence[i] == alphabet[k+4]):	
-						nucl_counts[k] += 1 
-						letter_found == 1
-						
-					k += 1
-					
-			self.DR_consensus += alphabet[nucl_counts.index(max(nucl_counts))]
+		self.profile = numpy.zeros((len(self.DR[0]), N_CODE + 1), dtype=numpy.int64)
+		for DR in self.DR:
+			self.add_to_profile(DR.sequence)
+		self.read_consensus()
+
+
+	# counts nucleotides of sequence in profile (positions beyond profile are ignored)
+	def add_to_profile(self, sequence):
+		codes = ENCODING_TABLE[numpy.frombuffer(str(sequence[:len(self.profile)]).encode('ascii', 'replace'), dtype=numpy.uint8)]
+		self.profile[numpy.arange(len(codes)), codes] += 1
+
+
+	# reads consensus from profile, in case of tie first nucleotide in order A, C, G, T is chosen
+	def read_consensus(self):
+		self.DR_consensus = DECODING_TABLE[self.profile[:, :N_CODE].argmax(axis=1)].tobytes().decode()
+
+
+	# removes first left and last right positions of profile, consensus is updated
+	def trim_profile(self, left, right):
+		self.profile = self.profile[left:(len(self.profile) - right)]
+		self.read_consensus()
 
 					
 	# with adding DR, we have to add also corresponding Spacer as well as to update
@@ -1428,23 +3101,40 @@ class CRISPR:
 		self.DR.insert(index, DR)
 		# adding DR to start
 		if index == 0:
-			new_spacer = Spacer(fasta.sequence[self.DR[0].end : (self.DR[1].begin - 1)],\
-			 self.DR[0].end + 1, self.DR[1].begin - 1)
+			new_spacer = Spacer(fasta.sequence, self.DR[0].end + 1, self.DR[1].begin - 1, self.DR[0].end)
 			self.spacers.insert(0, new_spacer)
 			self.begin = self.DR[0].begin		# updating start limit
 			
 		# adding DR to end
 		elif index == (len(self.DR) - 1) or index == None : 
-			new_spacer = Spacer(fasta.sequence[self.DR[len(self.DR) - 2].end\
-			 : (self.DR[len(self.DR) - 1].begin - 1)],\
-			 self.DR[len(self.DR) - 2].end + 1, self.DR[len(self.DR) - 1].begin - 1)
+			new_spacer = Spacer(fasta.sequence, self.DR[len(self.DR) - 2].end + 1,\
+			 self.DR[len(self.DR) - 1].begin - 1, self.DR[len(self.DR) - 2].end)
 			self.spacers.insert(len(self.spacers), new_spacer)
 			self.end = self.DR[-1].end		# updating end limit
 		
-		# update DR consensus
-		self.calculate_consensus()
+		# update DR consensus (from scratch if length of DR differs from consensus)
+		if len(DR) == len(self.profile):
+			self.add_to_profile(DR.sequence)
+			self.read_consensus()
+		else:
+			self.calculate_consensus()
 			
 
+	# DRs and spacers get copies of their sequences instead of views of analysed sequence
+	def copy_sequences (self):
+		for element in self.DR + self.spacers:
+			element.sequence = element.sequence
+
+
+	# moves CRISPR by offset bases (used when analyzed sequence is only a part of record)
+	def shift (self, offset):
+		self.begin += offset
+		self.end += offset
+		for element in self.DR + self.spacers:
+			element.begin += offset
+			element.end += offset
+
+
 	def __str__ (self):
 		string = ""	
 		for i in range(0, len(self.DR) - 1):
@@ -1467,19 +3157,27 @@ class Pattern:
 		for symbol in self.pattern:
 			if symbol == '#':
 				self.length += 1
+
+		# pattern is compiled once: positions of '#' and blocks of consecutive '#' as (start, end)
+		self.offsets = [i for i in range(0, self.n_symbols) if self.pattern[i] == '#']
+		self.blocks = [(match.start(), match.end()) for match in re.finditer('#+', self.pattern)]
 				
+	# seed at position (shorter at the end of string)
 	def extract_pattern (self, input_string, position):
-		output_string = ""
-		actual_pos = 0
-		# in case of end of string
-		upper_limit = len(self.pattern)
-		if (position + len(self.pattern)) > len(input_string):
-			upper_limit = len(input_string) - position
-		while actual_pos < upper_limit:
-			if self.pattern[actual_pos] == '#':
-				output_string = output_string + input_string[actual_pos+position]
-			actual_pos = actual_pos + 1
-		return output_string
+		return ''.join([input_string[position+start : position+end] for start, end in self.blocks])
+
+	# seeds at every position of string, in order (only the complete ones if complete_only)
+	def extract_patterns (self, input_string, complete_only = False):
+		if not self.offsets:
+			return [''] * len(input_string)
+		# all characters of each complete seed are taken at once from shifted copies of string
+		shifted = [input_string[offset:] for offset in self.offsets]
+		seeds = list(map(''.join, zip(*shifted)))
+		if complete_only:
+			return seeds
+		for position in range(len(seeds), len(input_string)):
+			seeds.append(self.extract_pattern(input_string, position))
+		return seeds
 	
 	# returns positions of "_" within pattern
 	def return_blanks (self):
@@ -1497,8 +3195,8 @@ class Pattern:
 if __name__ == '__main__':
 	import argparse
 	parser = argparse.ArgumentParser()
-	parser.add_argument('--fasta', type=str, required=True)
-	parser.add_argument('--output_dir', type=str, required=True)
+	parser.add_argument('--fasta', type=str)
+	parser.add_argument('--output_dir', type=str)
 	parser.add_argument('--kmer_size_filter', type=int, help='is used to compare segments of DRs and spacers', default=3)
 	parser.add_argument('--pattern', type=str, help="is a combination of '#' (character) and '_' (space) used as seeds during second pass. First pass used continuous seed of length k_mer_size (number of '#')", default="####_####")
 	parser.add_argument('--window_size', type=int, help="defines size of window in which k_mers will be searched for", default=200)
@@ -1510,8 +3208,46 @@ if __name__ == '__main__':
 	parser.add_argument('--max_spacer_dr_ratio', type=float, help="is maximum quotient allowed length of spacer versus DR", default=2.5)
 	parser.add_argument('--first_pass_limit', type=int, help="is maximum allowed distance between two regions with repeats", default=200)
 	parser.add_argument('--search_tracrrna', action='store_true', default=False)
+	parser.add_argument('--regions', type=str, nargs='+', help="restricts analysis to listed sequences or regions ('name' or 'name:start-end', 1-based), fasta file is indexed (.fai)")
+	parser.add_argument('--bed', type=str, help="restricts analysis to regions of BED file, fasta file is indexed (.fai)")
+	parser.add_argument('--encode', action='store_true', default=False, help="stores sequences as arrays of nucleotide codes (compact and case insensitive)")
+	parser.add_argument('--workers', type=int, default=1, help="number of processes analysing sequences in parallel")
+	parser.add_argument('--chunk_size', type=int, default=None, help="with several workers, sequences longer than chunk_size are analysed in parallel by chunks")
+	parser.add_argument('--output_format', type=str, nargs='+', choices=OUTPUT_FORMATS, default=['legacy'], help="formats of results: legacy report files and/or single jsonl, tsv and gff3 files")
+	parser.add_argument('--result_store', action='store_true', default=False, help="packs report files into a single SQLite file (%s) of output directory" % RESULT_STORE_NAME)
+	parser.add_argument('--catalog', type=str, default=None, help="SQLite catalog where DR consensuses and spacers of found CRISPRs are added (or queried with --query)")
+	parser.add_argument('--query', type=str, nargs='+', help="looks up sequences (DR or spacer) in catalog instead of analysing fasta file")
+	parser.add_argument('--mismatches', type=int, default=0, help="maximum number of mismatches of catalog query (at most %d)" % CATALOG_MISMATCHES)
+	parser.add_argument('--pipeline', action='store_true', default=False, help="reads next sequence and writes results of previous one in threads during analysis (tracrRNA messages are printed among those of next sequences)")
+	parser.add_argument('--sweep', type=str, nargs='+', help="analyses fasta file with every combination of listed values of parameters (given as name=value1,value2 with names of these options), first pass is shared and results are written to sweep.tsv of output directory")
+	parser.add_argument('--cache_dir', type=str, default=None, help="directory caching first and second pass results of sequences, reused by later analyses of same sequences")
+	parser.add_argument('--cache_size', type=float, default=256, help="maximum size of cache in MB, least recently used results are removed")
+	parser.add_argument('--metagenome', action='store_true', default=False, help="analyses many short contigs: too short ones are skipped, k-mers are counted by batches of contigs and only contigs with CRISPRs are reported")
+	parser.add_argument('--first_pass_engine', type=str, choices=FIRST_PASS_ENGINES, default='window', help="way of counting k-mers during first pass ('ring' keeps only k-mers of window in memory, 'vector' is fastest, 'seed' finds repeats by sorting exact seeds instead of window, its zones can differ from those of other engines)")
+	parser.add_argument('--prefilter', action='store_true', default=False, help="counts k-mers of first pass only in parts of sequences where a sketch of k-mers finds possible repeats")
+	parser.add_argument('--verify_prefilter', action='store_true', default=False, help="with --prefilter, also searches zones of first pass on whole sequences and stops if they differ")
 
 	args = vars(parser.parse_args())
+	if args['query']:
+		if args['catalog'] is None:
+			parser.error("--query requires --catalog")
+		catalog = Catalog(args['catalog'])
+		for sequence in args['query']:
+			for hit in catalog.query(sequence, args['mismatches']):
+				print("%s\t%s\t%s\t%d\t%s\t%s\t%d\t%d\t%s" % (sequence, hit['kind'], hit['sequence'], hit['mismatches'],\
+				 hit['source'], hit['record'], hit['crispr'], hit['begin'], hit['end']))
+		catalog.close()
+		sys.exit()
+	if args['fasta'] is None or args['output_dir'] is None:
+		parser.error("--fasta and --output_dir are required")
+	options = {'encode': args['encode'], 'first_pass_engine': args['first_pass_engine'], 'workers': args['workers'], 'chunk_size': args['chunk_size'],\
+	 'output_formats': args['output_format'], 'result_store': args['result_store'], 'catalog': args['catalog'],\
+	 'pipeline': args['pipeline'], 'cache_dir': args['cache_dir'], 'cache_size': args['cache_size'], 'metagenome': args['metagenome'],\
+	 'prefilter': args['prefilter'], 'verify_prefilter': args['verify_prefilter']}
+	if args['regions'] or args['bed']:
+		options['regions'] = (args['regions'] or []) + (read_bed(args['bed']) if args['bed'] else [])
+	sweep = args['sweep']
+	types = dict((name, type(args[name])) for name in SWEEP_PARAMETERS)		# types of swept values are those of defaults
 	args = [args['fasta'],
 			args['output_dir'],
 			args['kmer_size_filter'],
@@ -1526,7 +3262,19 @@ if __name__ == '__main__':
 			args['first_pass_limit'],
 			args['search_tracrrna']]
 
-	findCRISPRs = FindCRISPRs(*args)
-	findCRISPRs.analyze()
+	findCRISPRs = FindCRISPRs(*args, **options)
+	if sweep:
+		grid = {}
+		for item in sweep:
+			name, values = item.split('=', 1)
+			if name not in SWEEP_PARAMETERS:
+				parser.error("parameter '%s' can't be swept, choose among: %s" % (name, ', '.join(sorted(SWEEP_PARAMETERS))))
+			grid[name] = [types[name](value) for value in values.split(',')]
+		parameter_sets = parameter_grid(grid)
+		if not os.path.exists(args[1]):
+			os.makedirs(args[1])
+		findCRISPRs.write_sweep_table(findCRISPRs.sweep(parameter_sets), parameter_sets, os.path.join(args[1], 'sweep.tsv'))
+	else:
+		findCRISPRs.analyze()
 
 
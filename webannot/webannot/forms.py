@@ -1,6 +1,6 @@
 import io
 from flask_wtf import FlaskForm as Form
-from wtforms import TextAreaField, StringField, IntegerField, FloatField, SelectField
+from wtforms import TextAreaField, StringField, IntegerField, FloatField, SelectField, SelectMultipleField
 from wtforms.validators import DataRequired
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 from Bio import SeqIO
@@ -40,6 +40,10 @@ class CrisprFinderForm(Form):
                                     description='is maximum allowed distance between two regions with repeats')
     search_tracrrna = SelectField(choices=[('False', 'no'), ('True', 'yes')], default='False', description='',
                                   label='Search tracrRNA')
+    output_format = SelectMultipleField(choices=[('legacy', 'report files'), ('jsonl', 'JSON lines'), ('tsv', 'TSV'), ('gff3', 'GFF3')],
+                                        default=['legacy'],
+                                        description='formats of results, JSON lines, TSV and GFF3 files gather all CRISPRs',
+                                        label='Output Format')
 
     def validate(self):
         rv = Form.validate(self)
@@ -4,7 +4,7 @@ import sys
 import uuid
 import threading
 
-from flask import render_template, abort, redirect, request, url_for, jsonify
+from flask import render_template, abort, redirect, request, url_for, jsonify, Response
 from flask_restful import reqparse, inputs
 
 import werkzeug
@@ -12,7 +12,7 @@ from werkzeug.utils import secure_filename
 
 from webannot import app
 from .forms import CrisprFinderForm
-from .CRISPRFinder_beta2_11 import FindCRISPRs
+from .CRISPRFinder_beta2_11 import FindCRISPRs, RESULT_WRITERS, RESULT_STORE_NAME, ResultStore, Catalog
 
 
 def parse_crispr_finder_form():
@@ -33,6 +33,7 @@ def parse_crispr_finder_form():
     form_parser.add_argument('max_spacer_dr_ratio', type=float)
     form_parser.add_argument('first_pass_limit', type=int)
     form_parser.add_argument('search_tracrrna', type=inputs.boolean)
+    form_parser.add_argument('output_format', type=str, action='append')
     return form_parser.parse_args()
 
 # @copy_current_request_context
@@ -61,8 +62,15 @@ def crispr_finder_runner(**args):
                             args['max_spacer_dr_ratio'],
                             args['first_pass_limit'],
                             args['search_tracrrna']]
+            options = {'output_formats': args['output_format'].split(','),
+                       'result_store': args['result_store'],
+                       'catalog': args['catalog'],
+                       'pipeline': args['pipeline'],
+                       'cache_dir': args['cache_dir'],
+                       'cache_size': args['cache_size']}
             print('Generated Cmd: FindCRISPRs(*%s)' % ordered_args)
-            findCRISPRs = FindCRISPRs(*ordered_args)
+            print('Options: %s' % options)
+            findCRISPRs = FindCRISPRs(*ordered_args, **options)
             findCRISPRs.analyze()
             #create_flag_file(args['outputpath'], 'terminated')
     except:
@@ -100,6 +108,7 @@ def crispr_finder():
             results_dir = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
             os.makedirs(results_dir, exist_ok=True)
             args = parse_crispr_finder_form()
+            args['output_format'] = ','.join(args['output_format'] or ['legacy'])
             if args['sequence2']:
                 args['sequence2'] = args['sequence2'].rstrip()
                 s = io.BytesIO(args['sequence2'].encode('utf-8'))
@@ -116,6 +125,11 @@ def crispr_finder():
             args['inputpath'] = sequence_filepath
             args['outputpath'] = results_dir
             args['job_id'] = job_id
+            args['result_store'] = app.config.get('RESULT_STORE', False)
+            args['catalog'] = app.config.get('CRISPR_CATALOG')
+            args['pipeline'] = app.config.get('CRISPR_PIPELINE', False)
+            args['cache_dir'] = app.config.get('CRISPR_CACHE_DIR')
+            args['cache_size'] = app.config.get('CRISPR_CACHE_SIZE', 256)
             run_crispr = threading.Thread(
                 target=crispr_finder_runner, kwargs=args)
             run_crispr.start()
@@ -135,17 +149,60 @@ def crispr_finder_result(uuid):
     #, empty : os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], uuid, 'stdout'))
     result_files = []
     if not processing_flag:
-        if os.path.isdir(os.path.join(results_path, 'U')):
+        store_path = os.path.join(results_path, RESULT_STORE_NAME)
+        if os.path.isfile(store_path):
+            store = ResultStore(store_path)
+            try:
+                for path in store.list():
+                    result_files.append({'name': os.path.basename(path),
+                                         'url': url_for('crispr_finder_stored_file', uuid=uuid, path=path)})
+            finally:
+                store.close()
+        elif os.path.isdir(os.path.join(results_path, 'U')):
             for fname in os.listdir(os.path.join(results_path, 'U')):
                 result_files.append(dict([['name', fname],
                                           ['url', os.path.join(
                                               '/display', uuid, 'U', fname)]
                                           ]))
+        for writer in RESULT_WRITERS.values():
+            if os.path.isfile(os.path.join(results_path, writer.file_name)):
+                result_files.append({'name': writer.file_name.replace('.', '_'), 'url': os.path.join('/display', uuid, writer.file_name)})
     result_files.extend([{'name': 'stdout', 'url': os.path.join('/display', uuid, 'stdout')},
                          {'name': 'stderr', 'url': os.path.join('/display', uuid, 'stderr')}])
     return render_template('crispr_finder_result.html', uuid=uuid, processing=processing_flag, result_files=result_files)
 
 
+@app.route('/crispr_detect/result/<uuid>/files/<path:path>')
+def crispr_finder_stored_file(uuid, path):
+    store_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(uuid), RESULT_STORE_NAME)
+    if not os.path.isfile(store_path):
+        abort(404)
+    store = ResultStore(store_path)
+    try:
+        content = store.read(path)
+    finally:
+        store.close()
+    if content is None:
+        abort(404)
+    return Response(content, mimetype='text/plain')
+
+
+@app.route('/crispr_detect/catalog')
+def crispr_catalog():
+    if not app.config.get('CRISPR_CATALOG') or not os.path.isfile(app.config['CRISPR_CATALOG']):
+        abort(404)
+    sequence = request.args.get('sequence', '')
+    mismatches = request.args.get('mismatches', 0, type=int)
+    if not sequence:
+        abort(400)
+    catalog = Catalog(app.config['CRISPR_CATALOG'])
+    try:
+        hits = catalog.query(sequence, mismatches)
+    finally:
+        catalog.close()
+    return jsonify(hits)
+
+
 @app.route('/_processing')
 def processing():
     uuid = request.args.get('uuid')